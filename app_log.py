@@ -0,0 +1,195 @@
+import atexit
+import json
+import logging
+import os
+import random
+import re
+import sys
+import time
+import traceback
+
+import cooperative
+
+LOGGER_NAME = 'bulk_messenger'
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+
+# Registros aguardando gravação; acima disso são descartados (e contados)
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+
+# Tamanho máximo de cada texto e quantidade máxima de itens de listas no log
+LOG_MAX_FIELD = int(os.getenv('LOG_MAX_FIELD', '200'))
+LOG_MAX_ITEMS = int(os.getenv('LOG_MAX_ITEMS', '5'))
+
+# Fração dos eventos registrados, por tipo (avisos e erros nunca são amostrados).
+# Ex.: LOG_SAMPLING=send_result=0.05,validate_numbers=1
+DEFAULT_SAMPLING = {
+    'send_result': 0.1,
+}
+
+# Campos com números de telefone: só os 4 últimos dígitos aparecem
+NUMBER_FIELDS = {'number', 'numbers', 'remoteJid', 'jid', 'owner'}
+
+# Campos com texto de mensagem: nunca aparecem, apenas o tamanho
+TEXT_FIELDS = {'message', 'text', 'content', 'textMessage'}
+
+# Sequências longas de dígitos em textos livres (erros, respostas da API)
+_PHONE = re.compile(r'\d{8,}')
+
+_STOP = object()
+
+
+def parse_sampling(value):
+    sampling = dict(DEFAULT_SAMPLING)
+    for item in filter(None, (part.strip() for part in (value or '').split(','))):
+        event, _, rate = item.partition('=')
+        sampling[event.strip()] = float(rate)
+    return sampling
+
+
+SAMPLING = parse_sampling(os.getenv('LOG_SAMPLING'))
+
+
+def mask_number(value):
+    digits = str(value)
+    return '*' * max(0, len(digits) - 4) + digits[-4:]
+
+
+def _truncate(text):
+    if len(text) <= LOG_MAX_FIELD:
+        return text
+    return f'{text[:LOG_MAX_FIELD]}…(+{len(text) - LOG_MAX_FIELD})'
+
+
+def redact(value, key=None):
+    """Prepara um valor para o log sem dados pessoais em texto puro.
+
+    Números de telefone são mascarados, textos de mensagem substituídos pelo
+    tamanho, textos longos truncados e listas limitadas a LOG_MAX_ITEMS itens.
+    """
+    if key in TEXT_FIELDS and value is not None:
+        size = len(value) if isinstance(value, str) else len(json.dumps(value, ensure_ascii=False))
+        return f'<{size} caracteres>'
+    if isinstance(value, dict):
+        return {k: redact(v, k) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        items = [redact(item, key) for item in list(value)[:LOG_MAX_ITEMS]]
+        if len(value) > LOG_MAX_ITEMS:
+            items.append(f'…(+{len(value) - LOG_MAX_ITEMS})')
+        return items
+    if key in NUMBER_FIELDS and value is not None:
+        return mask_number(value)
+    if isinstance(value, str):
+        return _truncate(_PHONE.sub(lambda match: mask_number(match.group()), value))
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    return _truncate(str(value))
+
+
+class JsonFormatter(logging.Formatter):
+    # Uma linha JSON por registro: horário, nível, evento e campos já redigidos
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created))
+                  + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname.lower(),
+            'event': getattr(record, 'event', record.name),
+        }
+        message = record.getMessage()
+        if message != entry['event']:
+            entry['message'] = redact(message)
+        entry.update(redact(getattr(record, 'fields', None) or {}))
+        if record.exc_info:
+            lines = traceback.format_exception(*record.exc_info)
+            # Só o final do stack trace, que é onde está a causa
+            entry['exception'] = redact(''.join(lines[-3:]).strip())
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = SAMPLING.get(getattr(record, 'event', None), 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+
+class QueueLogHandler(logging.Handler):
+    """Enfileira os registros e os grava numa thread própria.
+
+    Quem registra o evento só paga a amostragem e um put na fila; a
+    formatação (com redação) e a escrita no stdout acontecem na thread
+    de gravação. Com a fila cheia o registro é descartado, nunca bloqueia.
+    A thread e a fila são nativas para não depender do loop do eventlet.
+    """
+
+    def __init__(self, stream=None, maxsize=LOG_QUEUE_SIZE):
+        super().__init__()
+        self.stream = stream or sys.stdout
+        self.dropped = 0
+        self._queue = cooperative.native_queue_class('Queue')(maxsize=maxsize)
+        self._thread = cooperative.original('threading').Thread(
+            target=self._run, name='log-writer', daemon=True)
+        self._thread.start()
+
+    def emit(self, record):
+        # Os argumentos são resolvidos agora; o resto fica para a thread de gravação
+        record.msg = record.getMessage()
+        record.args = None
+        try:
+            self._queue.put_nowait(record)
+        except Exception:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            record = self._queue.get()
+            if record is _STOP:
+                break
+            try:
+                self.stream.write(self.format(record) + '\n')
+                if self._queue.empty():
+                    self.stream.flush()
+            except Exception:
+                self.dropped += 1
+
+    def close(self):
+        # Grava o que ainda estiver na fila antes de encerrar
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout=5)
+        super().close()
+
+
+logger = logging.getLogger(LOGGER_NAME)
+
+_handler = None
+
+
+def setup(level=LOG_LEVEL):
+    # Envia os logs da aplicação (e de bibliotecas) para o handler em fila
+    global _handler
+    if _handler is not None:
+        return _handler
+    _handler = QueueLogHandler()
+    _handler.setFormatter(JsonFormatter())
+    _handler.addFilter(SamplingFilter())
+    root = logging.getLogger()
+    root.handlers = [_handler]
+    root.setLevel(level)
+    atexit.register(_handler.close)
+    return _handler
+
+
+def dropped():
+    return _handler.dropped if _handler else 0
+
+
+def log_event(event, level=logging.INFO, exc_info=False, **fields):
+    """Registra um evento estruturado.
+
+    Os campos passam por redação na formatação; não é preciso mascarar
+    números ou mensagens antes de chamar.
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, event, exc_info=exc_info, extra={'event': event, 'fields': fields})
@@ -0,0 +1,184 @@
+import logging
+import queue
+import threading
+import time
+
+from app_log import log_event
+
+_STOP = object()
+_FLUSH = object()
+
+# Espera antes de regravar um lote que falhou (dobra a cada falha seguida)
+RETRY_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+
+# Lotes guardados para nova tentativa, em múltiplos de batch_size; acima
+# disso os itens mais antigos são descartados
+RETRY_MAX_BATCHES = 50
+
+
+class BatchWriter:
+    """Fila consumida por uma thread dedicada que grava os itens em lotes.
+
+    Os itens são enfileirados por put() e entregues a write_batch() assim
+    que o lote atinge batch_size ou flush_interval expira. Subclasses
+    implementam write_batch() com a gravação propriamente dita.
+
+    Um lote que falha (ex.: banco bloqueado) não é descartado: volta a ser
+    gravado com backoff, junto do próximo lote ou no próximo flush.
+    write_batch() precisa ser atômico para que a nova tentativa não duplique
+    itens.
+    """
+
+    name = 'batch-writer'
+
+    def __init__(self, batch_size, flush_interval, maxsize=0):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+        # Itens de lotes que falharam, aguardando nova tentativa (só a thread
+        # de gravação mexe nestes campos)
+        self._retry = []
+        self._retry_delay = 0.0
+        self._retry_at = 0.0
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run,
+                                                name=self.name,
+                                                daemon=True)
+                self._thread.start()
+
+    def put(self, item, block=True):
+        # Com block=False, levanta queue.Full se a fila estiver no limite
+        self._queue.put(item, block=block)
+
+    def flush(self):
+        # Grava o lote atual sem esperar o intervalo e bloqueia até que todos
+        # os itens enfileirados tenham sido processados. Retorna quantos itens
+        # ainda aguardam nova tentativa (0 quando tudo foi gravado)
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(_FLUSH)
+        self._queue.join()
+        return len(self._retry)
+
+    def stop(self):
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None and thread.is_alive():
+            self._queue.put(_STOP)
+            thread.join()
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        return {
+            'queue_depth': self.depth(),
+            'written': self.written,
+            'batches': self.batches,
+            'failed': self.failed,
+            'retry_pending': len(self._retry),
+            'batch_size': self.batch_size,
+            'flush_interval': self.flush_interval,
+        }
+
+    def write_batch(self, batch):
+        raise NotImplementedError
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = None
+            if item is None:
+                # Fila vazia: aproveita para regravar os lotes pendentes
+                if self._retry and time.monotonic() >= self._retry_at:
+                    self._write([])
+                continue
+
+            batch = []
+            received = 1
+            flushing = item is _FLUSH
+            if item is _STOP:
+                stopping = True
+            elif not flushing:
+                batch.append(item)
+
+            # Junta o que mais chegar até encher o lote ou o prazo expirar
+            deadline = time.monotonic() + self.flush_interval
+            while not stopping and not flushing and len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                received += 1
+                if item is _STOP:
+                    stopping = True
+                elif item is _FLUSH:
+                    flushing = True
+                else:
+                    batch.append(item)
+
+            # Ao parar, grava também o que ainda estiver na fila
+            while stopping:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                received += 1
+                if item is not _STOP and item is not _FLUSH:
+                    batch.append(item)
+
+            try:
+                # flush e stop tentam de novo os lotes pendentes sem esperar o backoff
+                retry_due = bool(self._retry) and (flushing or stopping or time.monotonic() >= self._retry_at)
+                if batch or retry_due:
+                    self._write(batch, include_retry=retry_due)
+                if stopping and self._retry:
+                    self._drop(len(self._retry))
+            finally:
+                for _ in range(received):
+                    self._queue.task_done()
+
+    def _write(self, batch, include_retry=True):
+        if include_retry:
+            batch = self._retry + batch
+            self._retry = []
+        try:
+            self.write_batch(batch)
+        except Exception:
+            self._retry.extend(batch)
+            self._retry_delay = min(self._retry_delay * 2 or RETRY_DELAY, RETRY_MAX_DELAY)
+            self._retry_at = time.monotonic() + self._retry_delay
+            log_event('batch_write_error', logging.ERROR, exc_info=True, writer=self.name,
+                      items=len(batch), retry_in=self._retry_delay)
+            excess = len(self._retry) - self.batch_size * RETRY_MAX_BATCHES
+            if excess > 0:
+                self._drop(excess)
+            return
+        self.written += len(batch)
+        self.batches += 1
+        if include_retry:
+            self._retry_delay = 0.0
+        else:
+            # O banco voltou a aceitar gravações: os pendentes vão no próximo ciclo
+            self._retry_at = 0.0
+
+    def _drop(self, count):
+        # Descarta os itens mais antigos aguardando nova tentativa
+        del self._retry[:count]
+        self.failed += count
+        log_event('batch_write_dropped', logging.ERROR, writer=self.name, items=count)
@@ -0,0 +1,249 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from fake_evolution import FakeEvolutionAPI, parse_per_endpoint
+from load_test import measure, start_server, stop_server
+
+# Tamanhos do histórico usados por padrão
+DEFAULT_SIZES = (10000, 100000, 1000000)
+
+# Rotas medidas em cada tamanho
+BENCHMARK_ROUTES = (
+    '/',
+    '/get-history?limit=100',
+    '/list-templates',
+    '/check-instance-status?instance=bench0',
+)
+
+SEED_BATCH_SIZE = 10000
+
+# Distribuição dos status gerados (status, erro, peso)
+SEED_OUTCOMES = (
+    ('success', None, 85),
+    ('error', 'Erro 400: {"status":400,"error":"Bad Request"}', 6),
+    ('error', 'Erro 500: Internal Server Error', 2),
+    ('error', 'Read timed out. (read timeout=30)', 2),
+    ('suppressed', None, 5),
+)
+
+SEED_MESSAGES = tuple(f'Olá! Mensagem de campanha {index}: confira as novidades da semana.'
+                      for index in range(20))
+
+
+def _database():
+    # O caminho do banco é lido de DATABASE_PATH a cada nova conexão
+    import database
+    return database
+
+
+def seed_history(size, instances=3, days=90):
+    """Preenche message_history com `size` linhas distribuídas em `days` dias.
+
+    Usa a mesma rotina de gravação do HistoryWriter (corpos deduplicados,
+    agregados e índice de busca), em lotes de SEED_BATCH_SIZE.
+    """
+    database = _database()
+    database.init_db()
+    existing = database.count_history()
+    if existing >= size:
+        return {'rows': existing, 'seconds': 0.0, 'reused': True}
+
+    rng = random.Random(size)
+    statuses, errors, weights = zip(*((s, e, w) for s, e, w in SEED_OUTCOMES))
+    outcomes = list(zip(statuses, errors))
+    start = datetime.utcnow() - timedelta(days=days)
+    step = timedelta(days=days) / size
+
+    started = time.perf_counter()
+    batch = []
+    for index in range(existing, size):
+        status, error = rng.choices(outcomes, weights)[0]
+        sent_date = (start + step * index).strftime('%Y-%m-%d %H:%M:%S')
+        batch.append(database.history_row(
+            f'bench{index % instances}', f'5511{900000000 + index}',
+            rng.choice(SEED_MESSAGES), status, error,
+            rng.randint(10, 30), rng.randint(0, 3600), sent_date,
+            f'BENCH{index:010d}' if status == 'success' else None))
+        if len(batch) >= SEED_BATCH_SIZE:
+            database.save_message_history_batch(batch)
+            batch = []
+    if batch:
+        database.save_message_history_batch(batch)
+    return {'rows': size, 'seconds': round(time.perf_counter() - started, 2), 'reused': False}
+
+
+def copy_database(source, target):
+    # Cópia consistente via API de backup do SQLite (inclui o que estiver no WAL)
+    src, dst = sqlite3.connect(source), sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        src.close()
+        dst.close()
+
+
+def measure_history_writes(rows):
+    # Vazão do caminho de gravação usado pelos envios (submit + flush)
+    from history_writer import HistoryWriter
+
+    writer = HistoryWriter()
+    writer.start()
+    started = time.perf_counter()
+    for index in range(rows):
+        writer.submit('bench0', f'5521{900000000 + index}', SEED_MESSAGES[index % len(SEED_MESSAGES)],
+                      'success', None, 10, index, f'WRITE{index:010d}')
+    writer.flush()
+    seconds = time.perf_counter() - started
+    writer.stop()
+    return {
+        'rows': rows,
+        'seconds': round(seconds, 3),
+        'rows_per_second': round(rows / seconds, 1) if seconds else None,
+    }
+
+
+def process_memory(pid):
+    # RSS atual e pico (VmHWM) em MB, lidos do /proc (somente Linux)
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            fields = dict(line.split(':', 1) for line in status if ':' in line)
+    except OSError:
+        return None
+    return {
+        'rss_mb': round(int(fields['VmRSS'].split()[0]) / 1024, 1),
+        'peak_rss_mb': round(int(fields['VmHWM'].split()[0]) / 1024, 1),
+    }
+
+
+def benchmark_size(size, api, args):
+    path = os.path.join(args.workdir, f'bench-{size}.db')
+    os.environ['DATABASE_PATH'] = path
+    _database().close_pool()
+
+    result = {'seed': seed_history(size)}
+    _database().close_pool()
+
+    server, base_url = start_server(api, args.port, path, args.async_mode)
+    try:
+        result['memory_idle'] = process_memory(server.pid)
+        routes = {}
+        for route in BENCHMARK_ROUTES:
+            measure(base_url, args.warmup, 1, routes=(route,))
+            routes[route] = measure(base_url, args.requests, args.concurrency, routes=(route,))
+        result['routes'] = routes
+        result['memory_after'] = process_memory(server.pid)
+    finally:
+        stop_server(server)
+
+    # A gravação roda numa cópia para o banco semeado continuar com `size` linhas
+    write_path = os.path.join(args.workdir, f'bench-{size}-write.db')
+    copy_database(path, write_path)
+    os.environ['DATABASE_PATH'] = write_path
+    try:
+        result['history_write'] = measure_history_writes(args.write_rows)
+    finally:
+        _database().close_pool()
+        os.environ['DATABASE_PATH'] = path
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(write_path + suffix):
+                os.remove(write_path + suffix)
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous, current):
+    # Razão atual/anterior de p50, p99 e vazão de gravação, por tamanho e rota
+    lines = []
+    for size, result in current['sizes'].items():
+        before = previous.get('sizes', {}).get(size)
+        if not before:
+            continue
+        for route, stats in result['routes'].items():
+            old = before.get('routes', {}).get(route)
+            if old:
+                lines.append(f"{size:>8} {route:<42} p50 {stats['p50_ms'] / old['p50_ms']:.2f}x"
+                             f"  p99 {stats['p99_ms'] / old['p99_ms']:.2f}x")
+        old_write = before.get('history_write', {}).get('rows_per_second')
+        if old_write:
+            new_write = result['history_write']['rows_per_second']
+            lines.append(f"{size:>8} {'gravação do histórico':<42} vazão {new_write / old_write:.2f}x")
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark da aplicação contra uma Evolution API falsa')
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='Tamanhos do histórico, separados por vírgula')
+    parser.add_argument('--requests', type=int, default=500, help='Requisições por rota')
+    parser.add_argument('--warmup', type=int, default=20, help='Requisições de aquecimento por rota')
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--write-rows', type=int, default=20000,
+                        help='Linhas gravadas no teste de vazão do histórico')
+    parser.add_argument('--latency', action='append',
+                        help='Latência da API falsa em segundos (N ou endpoint=N, repetível)')
+    parser.add_argument('--error-rate', action='append',
+                        help='Taxa de erro da API falsa (N ou endpoint=N, repetível)')
+    parser.add_argument('--async-mode', default='eventlet', choices=('eventlet', 'threading'))
+    parser.add_argument('--port', type=int, default=5056)
+    parser.add_argument('--workdir', help='Diretório dos bancos gerados (reaproveitados entre execuções)')
+    parser.add_argument('--output', default='benchmark.json', help='Arquivo JSON com o resultado')
+    parser.add_argument('--compare', help='Resultado anterior para comparação')
+    args = parser.parse_args(argv)
+
+    args.workdir = args.workdir or tempfile.mkdtemp(prefix='benchmark-')
+    os.makedirs(args.workdir, exist_ok=True)
+    latency = parse_per_endpoint(args.latency)
+    error_rate = parse_per_endpoint(args.error_rate)
+
+    api = FakeEvolutionAPI(latency=latency, error_rate=error_rate).start()
+    try:
+        sizes = {}
+        for size in (int(value) for value in args.sizes.split(',')):
+            print(f'Medindo histórico com {size} linhas...', file=sys.stderr)
+            sizes[str(size)] = benchmark_size(size, api, args)
+    finally:
+        api.stop()
+
+    result = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'async_mode': args.async_mode,
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'api_latency': latency,
+            'api_error_rate': error_rate,
+        },
+        'sizes': sizes,
+    }
+    with open(args.output, 'w', encoding='utf-8') as output:
+        json.dump(result, output, indent=2)
+    print(json.dumps(result, indent=2))
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as previous:
+            print(compare(json.load(previous), result), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+import functools
+import importlib
+import os
+
+try:
+    import eventlet
+    from eventlet import patcher
+except ImportError:  # pragma: no cover - eventlet é opcional em desenvolvimento
+    eventlet = None
+
+# Modo do servidor: 'eventlet' (E/S cooperativa, padrão) ou 'threading'
+ASYNC_MODE = os.getenv('ASYNC_MODE', 'eventlet' if eventlet else 'threading')
+
+# Threads reais usadas para executar as chamadas ao SQLite no modo eventlet
+DB_THREADS = int(os.getenv('DB_THREADS', '8'))
+
+# Máximo de requisições/conexões atendidas simultaneamente (greenlets do servidor)
+SERVER_WORKERS = int(os.getenv('SERVER_WORKERS', '1000'))
+
+_enabled = False
+
+
+def monkey_patch():
+    """Ativa a E/S cooperativa do eventlet.
+
+    Precisa ser chamada antes de qualquer outro import (requests, threading,
+    time...), para que sockets, sleep e locks passem a ceder a vez ao loop
+    de eventos em vez de bloquear o processo inteiro.
+    """
+    global _enabled
+    if ASYNC_MODE != 'eventlet' or _enabled:
+        return
+    if eventlet is None:
+        raise RuntimeError('ASYNC_MODE=eventlet requer o pacote eventlet instalado')
+    eventlet.monkey_patch()
+    from eventlet import tpool
+    tpool.set_num_threads(DB_THREADS)
+    _enabled = True
+
+
+def enabled():
+    return _enabled
+
+
+def offload(func, *args, **kwargs):
+    # No modo eventlet, executa func numa thread real e libera o loop enquanto espera
+    if _enabled:
+        from eventlet import tpool
+        return tpool.execute(func, *args, **kwargs)
+    return func(*args, **kwargs)
+
+
+def offloaded(func):
+    # Decorador para funções bloqueantes (SQLite) chamadas a partir de greenlets
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return offload(func, *args, **kwargs)
+    return wrapper
+
+
+def original(module_name):
+    # Módulo da biblioteca padrão sem o monkey patching do eventlet
+    if eventlet is not None:
+        return patcher.original(module_name)
+    return importlib.import_module(module_name)
+
+
+def native_lock():
+    """Lock de sistema operacional, seguro nas threads do tpool.
+
+    Só deve proteger seções curtas que nunca cedem a vez (sem E/S), pois
+    um greenlet que espera por ele bloqueia o loop de eventos.
+    """
+    return original('_thread').allocate_lock()
+
+
+def native_queue_class(name='Queue'):
+    return getattr(original('queue'), name)
+
+
+def server_options():
+    # Argumentos extras de socketio.run para o modo em uso
+    if ASYNC_MODE == 'eventlet':
+        return {'max_size': SERVER_WORKERS}
+    # Servidor de desenvolvimento do Werkzeug, escolhido explicitamente
+    return {'allow_unsafe_werkzeug': True}
@@ -1,77 +1,968 @@
+import base64
+import hashlib
+import json
+import logging
+import os
+import queue
+import re
 import sqlite3
-from datetime import datetime
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 
-def init_db():
-    conn = sqlite3.connect('whatsapp.db')
-    c = conn.cursor()
-    
-    # Tabela para números validados
-    c.execute('''CREATE TABLE IF NOT EXISTS validated_numbers
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  number TEXT NOT NULL,
-                  instance_name TEXT NOT NULL,
-                  is_valid BOOLEAN NOT NULL,
-                  validation_date TIMESTAMP NOT NULL,
-                  UNIQUE(number, instance_name))''')
-    
-    # Tabela para histórico de mensagens
-    c.execute('''CREATE TABLE IF NOT EXISTS message_history
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  instance_name TEXT NOT NULL,
-                  number TEXT NOT NULL,
-                  message TEXT NOT NULL,
-                  status TEXT NOT NULL,
-                  error TEXT,
-                  delay INTEGER,
-                  sent_date TIMESTAMP NOT NULL)''')
-    
-    conn.commit()
-    conn.close()
-
-def get_db():
-    conn = sqlite3.connect('whatsapp.db')
+import cooperative
+import metrics
+from app_log import log_event
+
+# Caminho único do banco de dados (pode ser sobrescrito via .env)
+DEFAULT_DATABASE = 'messages.db'
+
+# Quantidade máxima de conexões mantidas abertas no pool
+POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '8'))
+
+# Tamanho do cache de statements preparados por conexão
+CACHED_STATEMENTS = 256
+
+# Pragmas aplicados a cada nova conexão
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',      # leitores não bloqueiam o escritor
+    'PRAGMA synchronous = NORMAL',    # seguro com WAL e bem mais rápido que FULL
+    'PRAGMA foreign_keys = ON',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -16000',     # ~16MB de cache de páginas
+)
+
+SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS message_templates
+       (id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        content TEXT NOT NULL)''',
+    '''CREATE TABLE IF NOT EXISTS message_history
+       (id INTEGER PRIMARY KEY AUTOINCREMENT,
+        instance_name TEXT NOT NULL,
+        number TEXT NOT NULL,
+        message TEXT NOT NULL DEFAULT '',
+        status TEXT NOT NULL,
+        error TEXT,
+        sent_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        delay INTEGER,
+        total_time INTEGER,
+        message_hash TEXT,
+        message_id TEXT,
+        delivery_status TEXT,
+        delivery_updated_at TIMESTAMP)''',
+    # Último status de entrega recebido pelo webhook, por id de mensagem
+    '''CREATE TABLE IF NOT EXISTS delivery_receipts
+       (message_id TEXT PRIMARY KEY,
+        instance_name TEXT,
+        status TEXT NOT NULL,
+        status_rank INTEGER NOT NULL,
+        updated_at TIMESTAMP NOT NULL) WITHOUT ROWID''',
+    # Números que pediram para não receber mensagens
+    '''CREATE TABLE IF NOT EXISTS suppression_list
+       (number TEXT PRIMARY KEY,
+        reason TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP) WITHOUT ROWID''',
+    # Corpo das mensagens armazenado uma única vez, endereçado pelo hash
+    '''CREATE TABLE IF NOT EXISTS message_bodies
+       (hash TEXT PRIMARY KEY,
+        content TEXT NOT NULL)''',
+    '''CREATE TABLE IF NOT EXISTS validated_numbers
+       (id INTEGER PRIMARY KEY AUTOINCREMENT,
+        number TEXT NOT NULL,
+        instance_name TEXT NOT NULL,
+        is_valid BOOLEAN NOT NULL,
+        validation_date TIMESTAMP NOT NULL,
+        UNIQUE(number, instance_name))''',
+    # Agregados do histórico por dia, instância, status e código de erro,
+    # mantidos incrementalmente a cada gravação
+    '''CREATE TABLE IF NOT EXISTS history_stats
+       (day TEXT NOT NULL,
+        instance_name TEXT NOT NULL,
+        status TEXT NOT NULL,
+        error_code TEXT NOT NULL DEFAULT '',
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, instance_name, status, error_code))''',
+    # Último checkpoint de cada envio (datas em epoch, como no registro em memória)
+    '''CREATE TABLE IF NOT EXISTS jobs
+       (job_id TEXT PRIMARY KEY,
+        instance_name TEXT,
+        status TEXT NOT NULL,
+        total INTEGER NOT NULL,
+        current INTEGER NOT NULL DEFAULT 0,
+        success_count INTEGER NOT NULL DEFAULT 0,
+        error_count INTEGER NOT NULL DEFAULT 0,
+        suppressed_count INTEGER NOT NULL DEFAULT 0,
+        last_number TEXT,
+        elapsed_time INTEGER,
+        started_at REAL NOT NULL,
+        updated_at REAL NOT NULL,
+        finished_at REAL,
+        summary TEXT) WITHOUT ROWID''',
+)
+
+# Colunas adicionadas depois da criação original das tabelas
+COLUMN_MIGRATIONS = (
+    ('message_history', 'message_hash', 'TEXT'),
+    ('message_history', 'message_id', 'TEXT'),
+    ('message_history', 'delivery_status', 'TEXT'),
+    ('message_history', 'delivery_updated_at', 'TIMESTAMP'),
+)
+
+INDEXES = (
+    # Índices para consultas paginadas do histórico
+    '''CREATE INDEX IF NOT EXISTS idx_history_sent_date
+       ON message_history (sent_date)''',
+    '''CREATE INDEX IF NOT EXISTS idx_history_instance_sent_date
+       ON message_history (instance_name, sent_date)''',
+    '''CREATE INDEX IF NOT EXISTS idx_history_message_hash
+       ON message_history (message_hash)''',
+    '''CREATE INDEX IF NOT EXISTS idx_history_message_id
+       ON message_history (message_id) WHERE message_id IS NOT NULL''',
+    '''CREATE INDEX IF NOT EXISTS idx_jobs_started_at
+       ON jobs (started_at)''',
+)
+
+# Busca textual no histórico (FTS5 com tokenizador trigram, que permite
+# encontrar fragmentos de números e de textos). O índice é de conteúdo
+# externo: o texto vem da view abaixo e só os termos ficam em history_fts.
+SEARCH_SCHEMA = (
+    '''CREATE VIEW IF NOT EXISTS history_search_source AS
+       SELECT h.id, h.number, h.error, COALESCE(b.content, h.message) AS message
+       FROM message_history h LEFT JOIN message_bodies b ON b.hash = h.message_hash''',
+    '''CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5
+       (number, error, message,
+        content = 'history_search_source', content_rowid = 'id',
+        tokenize = 'trigram')''',
+)
+
+# Mantêm o índice sincronizado com message_history. Os corpos em
+# message_bodies são imutáveis e gravados antes das linhas, então o texto
+# removido do índice é sempre o mesmo que foi indexado.
+_SEARCH_TEXT = "COALESCE((SELECT content FROM message_bodies WHERE hash = {row}.message_hash), {row}.message)"
+
+SEARCH_DELETE_TRIGGER = f'''CREATE TRIGGER IF NOT EXISTS history_fts_delete
+    AFTER DELETE ON message_history BEGIN
+        INSERT INTO history_fts (history_fts, rowid, number, error, message)
+        VALUES ('delete', old.id, old.number, old.error, {_SEARCH_TEXT.format(row='old')});
+    END'''
+
+SEARCH_TRIGGERS = (
+    f'''CREATE TRIGGER IF NOT EXISTS history_fts_insert AFTER INSERT ON message_history BEGIN
+        INSERT INTO history_fts (rowid, number, error, message)
+        VALUES (new.id, new.number, new.error, {_SEARCH_TEXT.format(row='new')});
+    END''',
+    SEARCH_DELETE_TRIGGER,
+    f'''CREATE TRIGGER IF NOT EXISTS history_fts_update
+        AFTER UPDATE OF number, error, message, message_hash ON message_history BEGIN
+        INSERT INTO history_fts (history_fts, rowid, number, error, message)
+        VALUES ('delete', old.id, old.number, old.error, {_SEARCH_TEXT.format(row='old')});
+        INSERT INTO history_fts (rowid, number, error, message)
+        VALUES (new.id, new.number, new.error, {_SEARCH_TEXT.format(row='new')});
+    END''',
+)
+
+HISTORY_COLUMNS = ('instance_name', 'number', 'message', 'status', 'error',
+                   'sent_date', 'delay', 'total_time', 'message_id', 'delivery_status')
+
+# O texto da mensagem vem de message_bodies; linhas antigas ainda têm o
+# texto na própria coluna message
+HISTORY_SELECT = ', '.join('COALESCE(b.content, h.message) AS message' if column == 'message'
+                           else f'h.{column}' for column in HISTORY_COLUMNS)
+HISTORY_FROM = 'message_history h LEFT JOIN message_bodies b ON b.hash = h.message_hash'
+
+
+_HTTP_ERROR = re.compile(r'^Erro (\d{3})')
+
+
+def normalize_error(error):
+    # Reduz a mensagem de erro a um código estável para os agregados
+    if not error:
+        return ''
+    match = _HTTP_ERROR.match(error)
+    if match:
+        return f'http_{match.group(1)}'
+    lowered = error.lower()
+    if 'timed out' in lowered or 'timeout' in lowered:
+        return 'timeout'
+    if 'connection' in lowered:
+        return 'connection_error'
+    return 'exception'
+
+
+def database_path():
+    return os.getenv('DATABASE_PATH', DEFAULT_DATABASE)
+
+
+def _connect():
+    conn = sqlite3.connect(database_path(),
+                           timeout=30,  # espera por locks (busy_timeout)
+                           check_same_thread=False,
+                           cached_statements=CACHED_STATEMENTS)
     conn.row_factory = sqlite3.Row
+    conn.create_function('normalize_error', 1, normalize_error, deterministic=True)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
     return conn
 
-def save_validated_number(number, instance_name, is_valid):
-    conn = get_db()
+
+class ConnectionPool:
+    """Pool de conexões SQLite compartilhado entre threads.
+
+    Cada thread retira uma conexão do pool enquanto a usa e a devolve ao
+    final, evitando o custo de abrir e fechar o arquivo a cada requisição.
+    No modo eventlet as funções deste módulo rodam nas threads reais do
+    tpool, por isso o pool usa fila e lock nativos.
+    """
+
+    def __init__(self, size=POOL_SIZE):
+        self.size = size
+        self._idle = cooperative.native_queue_class('LifoQueue')()
+        self._lock = cooperative.native_lock()
+        self._all = []
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if len(self._all) < self.size:
+                conn = _connect()
+                self._all.append(conn)
+                return conn
+
+        # Pool cheio: espera uma conexão ser devolvida
+        return self._idle.get()
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def close(self):
+        with self._lock:
+            for conn in self._all:
+                conn.close()
+            self._all = []
+            self._idle = cooperative.native_queue_class('LifoQueue')()
+
+
+_pool = ConnectionPool()
+
+
+@contextmanager
+def connection():
+    conn = _pool.acquire()
     try:
-        conn.execute('''INSERT OR REPLACE INTO validated_numbers 
-                       (number, instance_name, is_valid, validation_date)
-                       VALUES (?, ?, ?, ?)''',
-                    (number, instance_name, is_valid, datetime.now()))
-        conn.commit()
+        yield conn
     finally:
-        conn.close()
+        _pool.release(conn)
 
-def get_validated_numbers(instance_name):
-    conn = get_db()
+
+@contextmanager
+def transaction(statement='transaction'):
+    # Commit automático ao final do bloco, rollback em caso de exceção
+    with connection() as conn:
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        with metrics.SQLITE_COMMIT_DURATION.time(statement=statement):
+            conn.commit()
+
+
+def close_pool():
+    _pool.close()
+
+
+@cooperative.offloaded
+def init_db():
+    with transaction('init_db') as conn:
+        for statement in SCHEMA:
+            conn.execute(statement)
+        for table, column, definition in COLUMN_MIGRATIONS:
+            existing = {row['name'] for row in conn.execute(f'PRAGMA table_info({table})')}
+            if column not in existing:
+                conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+        for statement in INDEXES:
+            conn.execute(statement)
+    init_search()
+
+
+def init_search():
+    # Cria o índice de busca; bancos já existentes são indexados uma única vez
+    global search_available
     try:
-        cursor = conn.execute('''SELECT * FROM validated_numbers 
-                               WHERE instance_name = ? AND is_valid = 1
-                               ORDER BY validation_date DESC''',
-                            (instance_name,))
-        return cursor.fetchall()
-    finally:
-        conn.close()
+        with transaction('init_search') as conn:
+            exists = conn.execute('''SELECT 1 FROM sqlite_master
+                                     WHERE type = 'table' AND name = 'history_fts' ''').fetchone()
+            for statement in SEARCH_SCHEMA + SEARCH_TRIGGERS:
+                conn.execute(statement)
+            if not exists:
+                conn.execute("INSERT INTO history_fts (history_fts) VALUES ('rebuild')")
+        search_available = True
+    except sqlite3.OperationalError as e:
+        # SQLite sem FTS5 ou sem o tokenizador trigram (anterior à 3.34)
+        search_available = False
+        log_event('history_search_unavailable', logging.WARNING, error=str(e))
 
-def save_message_history(instance_name, number, message, status, error=None, delay=None):
-    conn = get_db()
+
+def row_to_dict(row):
+    return dict(row) if row is not None else None
+
+
+# Templates de mensagem
+
+@metrics.timed_query('list_templates')
+@cooperative.offloaded
+def list_templates(newest_first=False):
+    order = 'DESC' if newest_first else 'ASC'
+    with connection() as conn:
+        rows = conn.execute(
+            f'SELECT id, name, content FROM message_templates ORDER BY id {order}'
+        ).fetchall()
+    return [dict(row) for row in rows]
+
+
+@metrics.timed_query('get_template')
+@cooperative.offloaded
+def get_template(template_id):
+    with connection() as conn:
+        row = conn.execute('SELECT id, name, content FROM message_templates WHERE id = ?',
+                           (template_id,)).fetchone()
+    return row_to_dict(row)
+
+
+@metrics.timed_query('create_template')
+@cooperative.offloaded
+def create_template(name, content):
+    with transaction('create_template') as conn:
+        cursor = conn.execute('INSERT INTO message_templates (name, content) VALUES (?, ?)',
+                              (name, content))
+    return cursor.lastrowid
+
+
+@metrics.timed_query('update_template')
+@cooperative.offloaded
+def update_template(template_id, name, content):
+    with transaction('update_template') as conn:
+        cursor = conn.execute('UPDATE message_templates SET name = ?, content = ? WHERE id = ?',
+                              (name, content, template_id))
+    return cursor.rowcount
+
+
+@metrics.timed_query('delete_template')
+@cooperative.offloaded
+def delete_template(template_id):
+    with transaction('delete_template') as conn:
+        cursor = conn.execute('DELETE FROM message_templates WHERE id = ?', (template_id,))
+    return cursor.rowcount
+
+
+# Histórico de envios
+
+INSERT_HISTORY_SQL = '''INSERT INTO message_history
+                        (instance_name, number, message, message_hash, status, error,
+                         delay, total_time, sent_date, message_id)
+                        VALUES (:instance_name, :number, '', :message_hash, :status, :error,
+                                :delay, :total_time, COALESCE(:sent_date, CURRENT_TIMESTAMP),
+                                :message_id)'''
+
+INSERT_BODY_SQL = 'INSERT OR IGNORE INTO message_bodies (hash, content) VALUES (?, ?)'
+
+
+def message_hash(message):
+    return hashlib.sha256(message.encode('utf-8')).hexdigest()
+
+
+def history_row(instance_name, number, message, status, error=None, delay=None,
+                total_time=None, sent_date=None, message_id=None):
+    return {
+        'instance_name': instance_name,
+        'number': number,
+        'message': message,
+        'status': status,
+        'error': error,
+        'delay': delay,
+        'total_time': total_time,
+        'sent_date': sent_date,
+        'message_id': message_id,
+    }
+
+
+def save_message_history(instance_name, number, message, status, error=None,
+                         delay=None, total_time=None):
+    save_message_history_batch([history_row(instance_name, number, message, status,
+                                            error, delay, total_time)])
+
+
+UPSERT_STATS_SQL = '''INSERT INTO history_stats (day, instance_name, status, error_code, count)
+                      VALUES (?, ?, ?, ?, ?)
+                      ON CONFLICT (day, instance_name, status, error_code)
+                      DO UPDATE SET count = count + excluded.count'''
+
+
+def _stats_deltas(rows):
+    deltas = {}
+    today = datetime.utcnow().strftime('%Y-%m-%d')
+    for row in rows:
+        day = row['sent_date'][:10] if row.get('sent_date') else today
+        key = (day, row['instance_name'], row['status'], normalize_error(row['error']))
+        deltas[key] = deltas.get(key, 0) + 1
+    return [key + (count,) for key, count in deltas.items()]
+
+
+@metrics.timed_query('save_message_history_batch')
+@cooperative.offloaded
+def save_message_history_batch(rows):
+    # Grava várias linhas do histórico e atualiza os agregados na mesma transação
+    # Cada corpo de mensagem é gravado uma vez; as linhas guardam só o hash
+    bodies = {}
+    for row in rows:
+        digest = message_hash(row['message'])
+        bodies[digest] = row['message']
+        row['message_hash'] = digest
+
+    with transaction('save_message_history_batch') as conn:
+        conn.executemany(INSERT_BODY_SQL, bodies.items())
+        conn.executemany(INSERT_HISTORY_SQL, rows)
+        # As linhas de um mesmo executemany recebem ids consecutivos; o id de
+        # cada uma volta no próprio dict (usado pelo buffer de linhas recentes)
+        last_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+        for offset, row in enumerate(rows, start=last_id - len(rows) + 1):
+            row['id'] = offset
+            row['delivery_status'] = None
+        conn.executemany(UPSERT_STATS_SQL, _stats_deltas(rows))
+        # Recibos de entrega que chegaram antes da linha do histórico
+        message_ids = [row['message_id'] for row in rows if row.get('message_id')]
+        synced = conn.executemany(SYNC_DELIVERY_SQL, ((message_id,) for message_id in message_ids))
+        if synced.rowcount > 0:
+            statuses = dict(conn.execute(
+                f'''SELECT message_id, delivery_status FROM message_history
+                    WHERE id >= ? AND message_id IN ({', '.join('?' * len(message_ids))})''',
+                [rows[0]['id']] + message_ids).fetchall())
+            for row in rows:
+                row['delivery_status'] = statuses.get(row.get('message_id'))
+
+
+@metrics.timed_query('get_message_history')
+@cooperative.offloaded
+def get_message_history(limit=None):
+    sql = f'''SELECT {HISTORY_SELECT}
+              FROM {HISTORY_FROM}
+              ORDER BY h.sent_date DESC'''
+    params = ()
+    if limit is not None:
+        sql += ' LIMIT ?'
+        params = (limit,)
+    with connection() as conn:
+        rows = conn.execute(sql, params).fetchall()
+    return [dict(row) for row in rows]
+
+
+# Tamanho padrão e máximo de uma página do histórico
+HISTORY_PAGE_SIZE = 100
+HISTORY_MAX_PAGE_SIZE = 1000
+
+
+def encode_history_cursor(row):
+    raw = json.dumps([row['sent_date'], row['id']]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_history_cursor(cursor):
     try:
-        conn.execute('''INSERT INTO message_history 
-                       (instance_name, number, message, status, error, delay, sent_date)
-                       VALUES (?, ?, ?, ?, ?, ?, ?)''',
-                    (instance_name, number, message, status, error, delay, datetime.now()))
-        conn.commit()
-    finally:
-        conn.close()
+        sent_date, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return sent_date, int(row_id)
+    except (ValueError, TypeError):
+        raise ValueError('Cursor inválido')
+
+
+def history_filters(instance=None, status=None, date_from=None, date_to=None):
+    # Monta a cláusula WHERE dos filtros do histórico (date_to é exclusivo)
+    clauses = []
+    params = []
+    if instance:
+        clauses.append('h.instance_name = ?')
+        params.append(instance)
+    if status:
+        clauses.append('h.status = ?')
+        params.append(status)
+    if date_from:
+        clauses.append('h.sent_date >= ?')
+        params.append(date_from)
+    if date_to:
+        clauses.append('h.sent_date < ?')
+        params.append(date_to)
+    return clauses, params
+
+
+@metrics.timed_query('get_history_page')
+@cooperative.offloaded
+def get_history_page(cursor=None, limit=HISTORY_PAGE_SIZE, **filters):
+    """Retorna uma página do histórico usando paginação por chave (keyset).
+
+    A ordenação é (sent_date, id) decrescente e o cursor guarda a última
+    posição retornada, então o custo de cada página independe do offset.
+    """
+    limit = max(1, min(int(limit), HISTORY_MAX_PAGE_SIZE))
+    clauses, params = history_filters(**filters)
+    if cursor:
+        clauses.append('(h.sent_date, h.id) < (?, ?)')
+        params.extend(decode_history_cursor(cursor))
+
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    sql = f'''SELECT h.id, {HISTORY_SELECT}
+              FROM {HISTORY_FROM}
+              {where}
+              ORDER BY h.sent_date DESC, h.id DESC
+              LIMIT ?'''
+
+    with connection() as conn:
+        rows = conn.execute(sql, params + [limit + 1]).fetchall()
+
+    next_cursor = encode_history_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return [dict(row) for row in rows[:limit]], next_cursor
 
-def get_message_history():
-    conn = get_db()
+
+def iter_history(cursor=None, page_size=HISTORY_MAX_PAGE_SIZE, **filters):
+    # Percorre o histórico página a página sem materializar a tabela inteira
+    while True:
+        rows, cursor = get_history_page(cursor=cursor, limit=page_size, **filters)
+        yield from rows
+        if not cursor:
+            break
+
+
+# Busca textual no histórico
+
+# Indica se o SQLite em uso suporta o índice de busca (definido em init_search)
+search_available = False
+
+SEARCH_MIN_TERM = 3  # o tokenizador trigram não indexa termos menores
+
+_SEARCH_TERM = re.compile(r'"([^"]+)"|(\S+)')
+
+
+def build_search_query(text):
+    """Converte o texto digitado em uma expressão MATCH do FTS5.
+
+    Cada palavra (ou trecho entre aspas) vira uma frase literal e todas
+    precisam aparecer na linha, em qualquer uma das colunas indexadas.
+    A sintaxe do FTS5 não é exposta, então não há consultas inválidas.
+    """
+    terms = [quoted or word for quoted, word in _SEARCH_TERM.findall(text or '')]
+    terms = [term for term in terms if len(term) >= SEARCH_MIN_TERM]
+    if not terms:
+        raise ValueError(f'Informe ao menos um termo com {SEARCH_MIN_TERM} caracteres ou mais')
+    return ' AND '.join('"{}"'.format(term.replace('"', '""')) for term in terms)
+
+
+def encode_search_cursor(offset):
+    return base64.urlsafe_b64encode(json.dumps({'offset': offset}).encode()).decode()
+
+
+def decode_search_cursor(cursor):
     try:
-        cursor = conn.execute('''SELECT * FROM message_history 
-                               ORDER BY sent_date DESC 
-                               LIMIT 100''')
-        return cursor.fetchall()
-    finally:
-        conn.close()
+        offset = int(json.loads(base64.urlsafe_b64decode(cursor.encode()))['offset'])
+    except (ValueError, TypeError, KeyError):
+        raise ValueError('Cursor inválido')
+    if offset < 0:
+        raise ValueError('Cursor inválido')
+    return offset
+
+
+@metrics.timed_query('search_history')
+@cooperative.offloaded
+def search_history(text, cursor=None, limit=HISTORY_PAGE_SIZE, **filters):
+    """Busca no histórico por número, erro ou texto da mensagem.
+
+    Os resultados vêm ordenados por relevância (bm25) e paginados; o cursor
+    guarda a posição na lista ordenada. Aceita os mesmos filtros do histórico.
+    """
+    if not search_available:
+        raise RuntimeError('Busca no histórico indisponível neste SQLite')
+
+    limit = max(1, min(int(limit), HISTORY_MAX_PAGE_SIZE))
+    offset = decode_search_cursor(cursor) if cursor else 0
+    clauses, params = history_filters(**filters)
+    clauses.insert(0, 'history_fts MATCH ?')
+    params.insert(0, build_search_query(text))
+
+    sql = f'''SELECT h.id, {HISTORY_SELECT}, history_fts.rank AS rank
+              FROM history_fts
+              JOIN message_history h ON h.id = history_fts.rowid
+              LEFT JOIN message_bodies b ON b.hash = h.message_hash
+              WHERE {' AND '.join(clauses)}
+              ORDER BY history_fts.rank, h.id DESC
+              LIMIT ? OFFSET ?'''
+
+    with connection() as conn:
+        rows = conn.execute(sql, params + [limit + 1, offset]).fetchall()
+
+    next_cursor = encode_search_cursor(offset + limit) if len(rows) > limit else None
+    return [dict(row) for row in rows[:limit]], next_cursor
+
+
+@cooperative.offloaded
+def rebuild_history_search():
+    # Reconstrói o índice de busca a partir de message_history
+    if not search_available:
+        raise RuntimeError('Busca no histórico indisponível neste SQLite')
+    with transaction('rebuild_history_search') as conn:
+        conn.execute("INSERT INTO history_fts (history_fts) VALUES ('rebuild')")
+
+
+# Quantidade de linhas lidas por vez nas exportações
+EXPORT_CHUNK_SIZE = 5000
+
+
+@metrics.timed_query('get_history_chunk')
+@cooperative.offloaded
+def get_history_chunk(after=None, chunk_size=EXPORT_CHUNK_SIZE, **filters):
+    # Bloco do histórico em ordem cronológica, a partir da posição (sent_date, id)
+    clauses, params = history_filters(**filters)
+    if after:
+        clauses.append('(h.sent_date, h.id) > (?, ?)')
+        params.extend(after)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    sql = f'''SELECT h.id, {HISTORY_SELECT}
+              FROM {HISTORY_FROM}
+              {where}
+              ORDER BY h.sent_date, h.id
+              LIMIT ?'''
+
+    with connection() as conn:
+        return conn.execute(sql, params + [chunk_size]).fetchall()
+
+
+def iter_history_chunks(chunk_size=EXPORT_CHUNK_SIZE, **filters):
+    # Lê o histórico em blocos de tamanho fixo, em ordem cronológica, mantendo
+    # o uso de memória constante. Cada bloco é uma consulta curta por chave,
+    # então nenhuma conexão fica presa enquanto o bloco é consumido
+    after = None
+    while True:
+        rows = get_history_chunk(after, chunk_size, **filters)
+        if not rows:
+            break
+        yield rows
+        after = (rows[-1]['sent_date'], rows[-1]['id'])
+
+
+@metrics.timed_query('count_history')
+@cooperative.offloaded
+def count_history():
+    with connection() as conn:
+        return conn.execute('SELECT COUNT(*) FROM message_history').fetchone()[0]
+
+
+@metrics.timed_query('clear_message_history')
+@cooperative.offloaded
+def clear_message_history():
+    with transaction('clear_message_history') as conn:
+        # O sqlite3 só abre a transação antes de DML; sem o BEGIN explícito o
+        # DROP TRIGGER seria confirmado sozinho e não voltaria num rollback
+        conn.execute('BEGIN IMMEDIATE')
+        if search_available:
+            # Esvazia o índice de uma vez em vez de remover linha a linha pelo trigger
+            conn.execute('DROP TRIGGER IF EXISTS history_fts_delete')
+            conn.execute("INSERT INTO history_fts (history_fts) VALUES ('delete-all')")
+        conn.execute('DELETE FROM message_history')
+        if search_available:
+            conn.execute(SEARCH_DELETE_TRIGGER)
+        conn.execute('DELETE FROM message_bodies')
+        conn.execute('DELETE FROM history_stats')
+
+
+# Retenção do histórico
+
+def retention_cutoff(days):
+    # sent_date é gravado em UTC no formato 'YYYY-MM-DD HH:MM:SS'
+    return (datetime.utcnow() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+@metrics.timed_query('get_history_before')
+@cooperative.offloaded
+def get_history_before(cutoff, limit):
+    with connection() as conn:
+        rows = conn.execute(f'''SELECT h.id, {HISTORY_SELECT}
+                                FROM {HISTORY_FROM}
+                                WHERE h.sent_date < ?
+                                ORDER BY h.sent_date, h.id
+                                LIMIT ?''', (cutoff, limit)).fetchall()
+    return [dict(row) for row in rows]
+
+
+@metrics.timed_query('delete_history_rows')
+@cooperative.offloaded
+def delete_history_rows(ids):
+    with transaction('delete_history_rows') as conn:
+        conn.executemany('DELETE FROM message_history WHERE id = ?', ((row_id,) for row_id in ids))
+
+
+@metrics.timed_query('delete_orphan_message_bodies')
+@cooperative.offloaded
+def delete_orphan_message_bodies():
+    with transaction('delete_orphan_message_bodies') as conn:
+        cursor = conn.execute('''DELETE FROM message_bodies
+                                 WHERE NOT EXISTS (SELECT 1 FROM message_history
+                                                   WHERE message_hash = message_bodies.hash)''')
+    return cursor.rowcount
+
+
+@cooperative.offloaded
+def compact_message_bodies(chunk_size=EXPORT_CHUNK_SIZE):
+    # Converte linhas antigas (texto na coluna message) para o formato deduplicado
+    converted = 0
+    while True:
+        with connection() as conn:
+            rows = conn.execute('''SELECT id, message FROM message_history
+                                   WHERE message_hash IS NULL
+                                   LIMIT ?''', (chunk_size,)).fetchall()
+        if not rows:
+            break
+
+        bodies = {}
+        updates = []
+        for row in rows:
+            digest = message_hash(row['message'])
+            bodies[digest] = row['message']
+            updates.append((digest, row['id']))
+
+        with transaction('compact_message_bodies') as conn:
+            conn.executemany(INSERT_BODY_SQL, bodies.items())
+            conn.executemany('''UPDATE message_history SET message = '', message_hash = ?
+                                WHERE id = ?''', updates)
+        converted += len(rows)
+    return converted
+
+
+# Agregados do histórico
+
+STATS_GROUP_COLUMNS = ('day', 'instance_name', 'status', 'error_code')
+
+
+@metrics.timed_query('get_history_stats')
+@cooperative.offloaded
+def get_history_stats(group_by=STATS_GROUP_COLUMNS, instance=None, status=None,
+                      date_from=None, date_to=None):
+    # Consulta os agregados; date_from/date_to são dias (YYYY-MM-DD), ambos inclusivos
+    unknown = [column for column in group_by if column not in STATS_GROUP_COLUMNS]
+    if unknown:
+        raise ValueError(f"Coluna de agrupamento inválida: {', '.join(unknown)}")
+    group_by = list(group_by)
+    clauses = []
+    params = []
+    if instance:
+        clauses.append('instance_name = ?')
+        params.append(instance)
+    if status:
+        clauses.append('status = ?')
+        params.append(status)
+    if date_from:
+        clauses.append('day >= ?')
+        params.append(date_from[:10])
+    if date_to:
+        clauses.append('day <= ?')
+        params.append(date_to[:10])
+
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    columns = ', '.join(group_by + ['COALESCE(SUM(count), 0) AS count'])
+    sql = f'SELECT {columns} FROM history_stats {where}'
+    if group_by:
+        sql += f" GROUP BY {', '.join(group_by)} ORDER BY {', '.join(group_by)}"
+
+    with connection() as conn:
+        rows = conn.execute(sql, params).fetchall()
+    return [dict(row) for row in rows]
+
+
+@metrics.timed_query('rebuild_history_stats')
+@cooperative.offloaded
+def rebuild_history_stats():
+    # Recalcula todos os agregados a partir do histórico existente
+    with transaction('rebuild_history_stats') as conn:
+        conn.execute('DELETE FROM history_stats')
+        conn.execute('''INSERT INTO history_stats (day, instance_name, status, error_code, count)
+                        SELECT date(sent_date), instance_name, status,
+                               normalize_error(error), COUNT(*)
+                        FROM message_history
+                        GROUP BY 1, 2, 3, 4''')
+        return conn.execute('SELECT COALESCE(SUM(count), 0) FROM history_stats').fetchone()[0]
+
+
+# Recibos de entrega (webhook)
+
+# Ordem dos status: um recibo atrasado nunca faz o status regredir
+DELIVERY_STATUS_RANK = {
+    'pending': 0,
+    'sent': 1,
+    'failed': 2,
+    'delivered': 3,
+    'read': 4,
+}
+
+UPSERT_RECEIPT_SQL = '''INSERT INTO delivery_receipts
+                        (message_id, instance_name, status, status_rank, updated_at)
+                        VALUES (:message_id, :instance_name, :status, :status_rank, :updated_at)
+                        ON CONFLICT (message_id) DO UPDATE SET
+                            status = excluded.status,
+                            status_rank = excluded.status_rank,
+                            updated_at = excluded.updated_at
+                        WHERE excluded.status_rank >= delivery_receipts.status_rank'''
+
+SYNC_DELIVERY_SQL = '''UPDATE message_history
+                       SET (delivery_status, delivery_updated_at) =
+                           (SELECT status, updated_at FROM delivery_receipts r
+                            WHERE r.message_id = message_history.message_id)
+                       WHERE message_id = ?1
+                         AND EXISTS (SELECT 1 FROM delivery_receipts WHERE message_id = ?1)'''
+
+
+@metrics.timed_query('save_delivery_receipts')
+@cooperative.offloaded
+def save_delivery_receipts(receipts):
+    # Recibos: dicts com message_id, instance_name, status e updated_at
+    rows = [dict(receipt, status_rank=DELIVERY_STATUS_RANK.get(receipt['status'], 0))
+            for receipt in receipts]
+    with transaction('save_delivery_receipts') as conn:
+        conn.executemany(UPSERT_RECEIPT_SQL, rows)
+        conn.executemany(SYNC_DELIVERY_SQL, {(row['message_id'],) for row in rows})
+
+
+# Lista de supressão (opt-out)
+
+@metrics.timed_query('add_suppressed_numbers')
+@cooperative.offloaded
+def add_suppressed_numbers(numbers, reason=None):
+    with transaction('add_suppressed_numbers') as conn:
+        before = conn.total_changes
+        conn.executemany('INSERT OR IGNORE INTO suppression_list (number, reason) VALUES (?, ?)',
+                         ((number, reason) for number in numbers))
+        return conn.total_changes - before
+
+
+@metrics.timed_query('remove_suppressed_numbers')
+@cooperative.offloaded
+def remove_suppressed_numbers(numbers):
+    with transaction('remove_suppressed_numbers') as conn:
+        before = conn.total_changes
+        conn.executemany('DELETE FROM suppression_list WHERE number = ?',
+                         ((number,) for number in numbers))
+        return conn.total_changes - before
+
+
+@cooperative.offloaded
+def _suppressed_numbers_chunk(after, chunk_size):
+    with connection() as conn:
+        rows = conn.execute('''SELECT number FROM suppression_list
+                               WHERE number > ?
+                               ORDER BY number
+                               LIMIT ?''', (after, chunk_size)).fetchall()
+    return [row[0] for row in rows]
+
+
+def iter_suppressed_numbers(chunk_size=EXPORT_CHUNK_SIZE):
+    # Percorre a lista em blocos pela chave primária
+    after = ''
+    while True:
+        numbers = _suppressed_numbers_chunk(after, chunk_size)
+        if not numbers:
+            break
+        yield from numbers
+        after = numbers[-1]
+
+
+@metrics.timed_query('list_suppressed_numbers')
+@cooperative.offloaded
+def list_suppressed_numbers(after=None, limit=HISTORY_PAGE_SIZE, search=None):
+    # Página da lista de supressão ordenada por número (paginação por chave)
+    clauses = []
+    params = []
+    if after:
+        clauses.append('number > ?')
+        params.append(after)
+    if search:
+        # Busca por prefixo como intervalo, para usar a chave primária
+        clauses.append('number >= ? AND number < ?')
+        params.extend([search, search + '\uffff'])
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    with connection() as conn:
+        rows = conn.execute(f'''SELECT number, reason, created_at FROM suppression_list
+                                {where}
+                                ORDER BY number
+                                LIMIT ?''', params + [limit]).fetchall()
+    return [dict(row) for row in rows]
+
+
+# Envios (jobs)
+
+JOB_COLUMNS = ('job_id', 'instance_name', 'status', 'total', 'current', 'success_count',
+               'error_count', 'suppressed_count', 'last_number', 'elapsed_time',
+               'started_at', 'updated_at', 'finished_at', 'summary')
+
+# Checkpoints fora de ordem não sobrescrevem um estado mais recente
+UPSERT_JOB_SQL = f'''INSERT INTO jobs ({', '.join(JOB_COLUMNS)})
+                     VALUES ({', '.join(':' + column for column in JOB_COLUMNS)})
+                     ON CONFLICT (job_id) DO UPDATE SET
+                     {', '.join(f'{column} = excluded.{column}' for column in JOB_COLUMNS[1:])}
+                     WHERE excluded.updated_at >= jobs.updated_at'''
+
+
+@metrics.timed_query('save_job_checkpoints')
+@cooperative.offloaded
+def save_job_checkpoints(records):
+    rows = [dict(record, summary=json.dumps(record['summary']) if record.get('summary') else None)
+            for record in records]
+    with transaction('save_job_checkpoints') as conn:
+        conn.executemany(UPSERT_JOB_SQL, rows)
+
+
+@metrics.timed_query('mark_interrupted_jobs')
+@cooperative.offloaded
+def mark_interrupted_jobs():
+    # Envios que estavam em andamento quando o processo parou
+    with transaction('mark_interrupted_jobs') as conn:
+        cursor = conn.execute('''UPDATE jobs SET status = 'interrupted', finished_at = updated_at
+                                 WHERE status = 'running' ''')
+    return cursor.rowcount
+
+
+@metrics.timed_query('list_jobs')
+@cooperative.offloaded
+def list_jobs(limit=HISTORY_PAGE_SIZE):
+    with connection() as conn:
+        rows = conn.execute(f'''SELECT {', '.join(JOB_COLUMNS)} FROM jobs
+                                ORDER BY started_at DESC
+                                LIMIT ?''', (limit,)).fetchall()
+    jobs = []
+    for row in rows:
+        job = dict(row)
+        job['summary'] = json.loads(job['summary']) if job['summary'] else None
+        jobs.append(job)
+    return jobs
+
+
+# Números validados
+
+@metrics.timed_query('save_validated_number')
+@cooperative.offloaded
+def save_validated_number(number, instance_name, is_valid):
+    with transaction('save_validated_number') as conn:
+        conn.execute('''INSERT OR REPLACE INTO validated_numbers
+                        (number, instance_name, is_valid, validation_date)
+                        VALUES (?, ?, ?, ?)''',
+                     (number, instance_name, is_valid, datetime.now()))
+
+
+@metrics.timed_query('get_validated_numbers')
+@cooperative.offloaded
+def get_validated_numbers(instance_name):
+    with connection() as conn:
+        rows = conn.execute('''SELECT * FROM validated_numbers
+                               WHERE instance_name = ? AND is_valid = 1
+                               ORDER BY validation_date DESC''',
+                            (instance_name,)).fetchall()
+    return [dict(row) for row in rows]
@@ -0,0 +1,104 @@
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import metrics
+
+CONNECT_TIMEOUT = float(os.getenv('EVOLUTION_CONNECT_TIMEOUT', '5'))
+READ_TIMEOUT = float(os.getenv('EVOLUTION_READ_TIMEOUT', '30'))
+MAX_RETRIES = int(os.getenv('EVOLUTION_MAX_RETRIES', '3'))
+BACKOFF_FACTOR = float(os.getenv('EVOLUTION_BACKOFF_FACTOR', '0.5'))
+POOL_MAXSIZE = int(os.getenv('EVOLUTION_POOL_MAXSIZE', '20'))
+SCHEME = os.getenv('EVOLUTION_SCHEME', 'https')
+
+
+class EvolutionClient:
+    """Cliente HTTP para a Evolution API.
+
+    Mantém uma Session (com pool de conexões keep-alive) por host, aplica
+    timeouts de conexão e leitura em todas as chamadas, repete com backoff
+    em erros de conexão e respostas 5xx, e registra a latência de cada
+    endpoint no histograma metrics.EVOLUTION_REQUEST_DURATION.
+    """
+
+    def __init__(self, server_url, api_key,
+                 connect_timeout=CONNECT_TIMEOUT,
+                 read_timeout=READ_TIMEOUT,
+                 max_retries=MAX_RETRIES,
+                 backoff_factor=BACKOFF_FACTOR,
+                 scheme=SCHEME):
+        self.base_url = f'{scheme}://{server_url}'
+        self.headers = {
+            'Content-Type': 'application/json',
+            'apikey': api_key
+        }
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _session(self, url):
+        host = urlsplit(url).netloc
+        session = self._sessions.get(host)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(host)
+                if session is None:
+                    session = self._new_session()
+                    self._sessions[host] = session
+        return session
+
+    def _new_session(self):
+        # Erros de conexão são repetidos em qualquer método (a requisição não
+        # chegou ao servidor); respostas 5xx só nos métodos idempotentes, para
+        # não duplicar envios de mensagem
+        retry = Retry(total=self.max_retries,
+                      connect=self.max_retries,
+                      read=0,
+                      status=self.max_retries,
+                      status_forcelist=(500, 502, 503, 504),
+                      allowed_methods=frozenset(['GET']),
+                      backoff_factor=self.backoff_factor,
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_MAXSIZE, max_retries=retry)
+        session = requests.Session()
+        session.headers.update(self.headers)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def request(self, method, endpoint, json=None, **path_params):
+        # endpoint é o caminho com marcadores, ex: '/message/sendText/{instance}';
+        # ele também serve de rótulo para as métricas de latência
+        url = self.base_url + endpoint.format(**path_params)
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            response = self._session(url).request(method, url, json=json, timeout=self.timeout)
+            status = response.status_code
+            return response
+        finally:
+            metrics.EVOLUTION_REQUEST_DURATION.observe(time.perf_counter() - started,
+                                                       method=method, endpoint=endpoint,
+                                                       status=status)
+
+    def get(self, endpoint, **path_params):
+        return self.request('GET', endpoint, **path_params)
+
+    def post(self, endpoint, json=None, **path_params):
+        return self.request('POST', endpoint, json=json, **path_params)
+
+    def latency_stats(self):
+        return metrics.EVOLUTION_REQUEST_DURATION.snapshot()
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions = {}
@@ -0,0 +1,80 @@
+import argparse
+import csv
+import io
+import sys
+import zlib
+
+from dotenv import load_dotenv
+
+import database
+
+EXPORT_COLUMNS = ('id',) + database.HISTORY_COLUMNS
+
+
+def csv_chunks(chunk_size=database.EXPORT_CHUNK_SIZE, compress=False, **filters):
+    """Gera o histórico em CSV, um bloco de bytes por vez.
+
+    Com compress=True a saída é gzip, comprimida à medida que os blocos
+    são produzidos, sem nunca montar o arquivo inteiro em memória.
+    """
+    compressor = zlib.compressobj(wbits=31) if compress else None  # 31 = formato gzip
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        data = buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+        return compressor.compress(data) if compressor else data
+
+    writer.writerow(EXPORT_COLUMNS)
+    yield flush()
+
+    for rows in database.iter_history_chunks(chunk_size=chunk_size, **filters):
+        writer.writerows(tuple(row) for row in rows)
+        data = flush()
+        if data:
+            yield data
+
+    if compressor:
+        yield compressor.flush()
+
+
+def export_filename(compress=False):
+    return 'message_history.csv.gz' if compress else 'message_history.csv'
+
+
+def main(argv=None):
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description='Exporta o histórico de envios em CSV')
+    parser.add_argument('-o', '--output', help='Arquivo de saída (padrão: stdout)')
+    parser.add_argument('--gzip', action='store_true', help='Comprime a saída com gzip')
+    parser.add_argument('--instance', help='Filtra por instância')
+    parser.add_argument('--status', help='Filtra por status')
+    parser.add_argument('--date-from', help='Data inicial (YYYY-MM-DD[ HH:MM:SS])')
+    parser.add_argument('--date-to', help='Data final, exclusiva (YYYY-MM-DD[ HH:MM:SS])')
+    parser.add_argument('--chunk-size', type=int, default=database.EXPORT_CHUNK_SIZE,
+                        help='Linhas lidas do banco por bloco')
+    args = parser.parse_args(argv)
+
+    database.init_db()
+
+    chunks = csv_chunks(chunk_size=args.chunk_size,
+                        compress=args.gzip,
+                        instance=args.instance,
+                        status=args.status,
+                        date_from=args.date_from,
+                        date_to=args.date_to)
+
+    output = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    try:
+        for chunk in chunks:
+            output.write(chunk)
+    finally:
+        if args.output:
+            output.close()
+
+
+if __name__ == '__main__':
+    main()
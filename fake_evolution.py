@@ -0,0 +1,148 @@
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+# Endpoints simulados, identificados pelo segundo segmento do caminho
+ENDPOINTS = ('fetchInstances', 'connectionState', 'whatsappNumbers', 'sendText')
+
+
+def _per_endpoint(value):
+    # Aceita um valor único ou um dicionário por endpoint (chave 'default' opcional)
+    if isinstance(value, dict):
+        default = value.get('default', 0.0)
+        return {endpoint: value.get(endpoint, default) for endpoint in ENDPOINTS}
+    return {endpoint: value for endpoint in ENDPOINTS}
+
+
+def parse_per_endpoint(values, default=0.0):
+    """Converte opções de linha de comando em valor por endpoint.
+
+    Cada item é um número (vale para todos os endpoints) ou 'endpoint=número',
+    por exemplo: --latency 0.02 --latency sendText=0.3
+    """
+    result = {'default': default}
+    for value in values or ():
+        endpoint, _, number = value.rpartition('=')
+        if endpoint and endpoint not in ENDPOINTS:
+            raise ValueError(f'Endpoint desconhecido: {endpoint}')
+        result[endpoint or 'default'] = float(number)
+    return result
+
+
+class FakeEvolutionAPI:
+    """Evolution API falsa para testes de carga e benchmarks.
+
+    Responde aos endpoints usados pela aplicação com latência e taxa de
+    erro configuráveis por endpoint, sem enviar nada ao WhatsApp.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, error_rate=0.0, instances=1):
+        self.latency = _per_endpoint(latency)
+        self.error_rate = _per_endpoint(error_rate)
+        self.instances = [f'bench{index}' for index in range(instances)]
+        self.calls = {endpoint: 0 for endpoint in ENDPOINTS}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def address(self):
+        host, port = self._server.server_address[:2]
+        return f'{host}:{port}'
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def start(self):
+        # Atende em uma thread própria (uso dentro de outros scripts)
+        self._thread = threading.Thread(target=self.serve_forever,
+                                        name='fake-evolution', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _respond(self, endpoint, instance, body):
+        with self._lock:
+            self.calls[endpoint] += 1
+        time.sleep(self.latency[endpoint])
+        if random.random() < self.error_rate[endpoint]:
+            return 500, {'error': 'Erro simulado'}
+
+        if endpoint == 'fetchInstances':
+            return 200, [{'instance': {'instanceName': name, 'status': 'open',
+                                       'owner': f'5511900000{index:03d}@s.whatsapp.net'}}
+                         for index, name in enumerate(self.instances)]
+        if endpoint == 'connectionState':
+            if instance not in self.instances:
+                return 404, {'error': 'Instância não encontrada'}
+            return 200, {'instance': instance, 'state': 'open'}
+        if endpoint == 'whatsappNumbers':
+            return 200, [{'number': number, 'exists': True, 'jid': f'{number}@s.whatsapp.net'}
+                         for number in body.get('numbers', [])]
+        return 201, {'key': {'id': uuid.uuid4().hex.upper(), 'remoteJid': body.get('number')},
+                     'status': 'PENDING'}
+
+    def _handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _dispatch(self):
+                parts = urlparse(self.path).path.strip('/').split('/')
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length) or b'{}') if length else {}
+                endpoint = parts[1] if len(parts) > 1 else ''
+                if endpoint not in ENDPOINTS:
+                    status, payload = 404, {'error': 'Endpoint não simulado'}
+                else:
+                    instance = parts[2] if len(parts) > 2 else None
+                    status, payload = api._respond(endpoint, instance, body)
+
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = _dispatch
+            do_POST = _dispatch
+
+        return Handler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Evolution API falsa para testes locais')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', action='append',
+                        help='Latência das respostas em segundos (N ou endpoint=N, repetível)')
+    parser.add_argument('--error-rate', action='append',
+                        help='Fração de respostas com erro 500 (N ou endpoint=N, repetível)')
+    parser.add_argument('--instances', type=int, default=1, help='Quantidade de instâncias simuladas')
+    args = parser.parse_args(argv)
+
+    api = FakeEvolutionAPI(args.host, args.port, parse_per_endpoint(args.latency),
+                           parse_per_endpoint(args.error_rate), args.instances)
+    print(f'Evolution API falsa em http://{api.address} (instâncias: {", ".join(api.instances)})')
+    try:
+        api.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
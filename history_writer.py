@@ -0,0 +1,39 @@
+import os
+import time
+
+import database
+from batch_writer import BatchWriter
+from recent_history import recent_history
+
+# Quantidade máxima de linhas por transação
+BATCH_SIZE = int(os.getenv('HISTORY_BATCH_SIZE', '200'))
+
+# Tempo máximo (segundos) que uma linha espera na fila antes de ser gravada
+FLUSH_INTERVAL = float(os.getenv('HISTORY_FLUSH_INTERVAL', '1.0'))
+
+
+class HistoryWriter(BatchWriter):
+    """Grava o histórico de envios em segundo plano, em lotes.
+
+    As linhas são enfileiradas por submit() e gravadas com executemany,
+    tirando o commit (fsync) do caminho de cada envio.
+    """
+
+    name = 'history-writer'
+
+    def __init__(self, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        super().__init__(batch_size, flush_interval)
+
+    def submit(self, instance_name, number, message, status, error=None,
+               delay=None, total_time=None, message_id=None):
+        # A data é registrada no momento do envio, não no momento da gravação
+        sent_date = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+        self.put(database.history_row(instance_name, number, message, status,
+                                      error, delay, total_time, sent_date, message_id))
+
+    def write_batch(self, batch):
+        database.save_message_history_batch(batch)
+        recent_history.extend(batch)
+
+
+history_writer = HistoryWriter()
@@ -0,0 +1,163 @@
+import logging
+import os
+import threading
+import time
+
+from app_log import log_event
+
+# Intervalo entre atualizações do estado das instâncias (segundos)
+POLL_INTERVAL = float(os.getenv('INSTANCE_POLL_INTERVAL', '15'))
+
+# Idade máxima do cache antes de forçar uma atualização síncrona (segundos)
+CACHE_TTL = float(os.getenv('INSTANCE_CACHE_TTL', '45'))
+
+
+def normalize_instances(data):
+    # Garante que o retorno seja sempre uma lista
+    if not isinstance(data, list):
+        data = [data] if data else []
+    return data
+
+
+def resolve_status(instance_info, connection_state):
+    # Determina o status real da instância
+    instance_status = (instance_info.get('status') or 'unknown').upper()
+    connection_state = (connection_state or 'unknown').upper()
+
+    # Se a instância está com status 'open', consideramos que está conectada
+    if instance_status == 'OPEN':
+        final_status = 'CONNECTED'
+    # Se está com status 'connecting', está tentando conectar
+    elif instance_status == 'CONNECTING':
+        final_status = 'CONNECTING'
+    # Se o estado da conexão indica que está conectada
+    elif connection_state == 'CONNECTED':
+        final_status = 'CONNECTED'
+    # Se está em qualquer outro estado, consideramos desconectada
+    else:
+        final_status = 'DISCONNECTED'
+
+    return {
+        'status': final_status,
+        'details': {
+            'owner': instance_info.get('owner'),
+            'profileName': instance_info.get('name'),
+            'connectionState': connection_state,
+            'instanceStatus': instance_status
+        }
+    }
+
+
+class InstancePoller:
+    """Mantém em cache o estado das instâncias da Evolution API.
+
+    Uma única tarefa em segundo plano consulta a API a cada intervalo e
+    as rotas respondem a partir do cache. Mudanças de status são enviadas
+    aos clientes pelo evento 'instance_status' do Socket.IO.
+    """
+
+    def __init__(self, socketio, client, interval=POLL_INTERVAL, ttl=CACHE_TTL):
+        self.socketio = socketio
+        self.client = client
+        self.interval = interval
+        self.ttl = ttl
+        self._refresh_lock = threading.Lock()
+        self._started = False
+        self._instances = []
+        self._statuses = {}
+        self._error = None
+        self._updated_at = 0.0
+        self._attempted_at = 0.0
+
+    def start(self):
+        if not self._started:
+            self._started = True
+            self.socketio.start_background_task(self._run)
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception:
+                log_event('instance_poll_error', logging.ERROR, exc_info=True)
+            self.socketio.sleep(self.interval)
+
+    def refresh(self):
+        # Evita atualizações simultâneas: quem chegar depois aproveita o resultado
+        requested_at = time.time()
+        with self._refresh_lock:
+            if self._attempted_at >= requested_at:
+                return
+            self._attempted_at = time.time()
+            try:
+                response = self.client.get('/instance/fetchInstances')
+                if response.status_code != 200:
+                    self._error = {
+                        'error': f'Erro ao buscar instâncias: {response.text}',
+                        'status_code': response.status_code
+                    }
+                    return
+
+                instances = normalize_instances(response.json())
+                statuses = {}
+                for item in instances:
+                    info = item.get('instance', {})
+                    name = info.get('instanceName')
+                    if not name:
+                        continue
+
+                    connection_state = None
+                    state_response = self.client.get('/instance/connectionState/{instance}',
+                                                     instance=name)
+                    if state_response.status_code == 200:
+                        connection_state = state_response.json().get('state')
+
+                    statuses[name] = resolve_status(info, connection_state)
+            except Exception as e:
+                self._error = {'error': f'Erro ao buscar instâncias: {str(e)}'}
+                return
+
+            previous = self._statuses
+            self._instances = instances
+            self._statuses = statuses
+            self._error = None
+            self._updated_at = time.time()
+
+        self._emit_changes(previous, statuses)
+
+    def _emit_changes(self, previous, current):
+        for name, status in current.items():
+            if previous.get(name) != status:
+                self.socketio.emit('instance_status', dict(status, instance=name))
+        for name in previous.keys() - current.keys():
+            self.socketio.emit('instance_status', {
+                'instance': name,
+                'status': 'error',
+                'error': 'Instância não encontrada'
+            })
+
+    def _stale(self):
+        # Idade medida a partir da última atualização bem-sucedida
+        return time.time() - self._updated_at > self.ttl
+
+    def _ensure_fresh(self):
+        # Só consulta a API na requisição se o poller estiver atrasado
+        if self._stale():
+            self.refresh()
+
+    def instances(self):
+        self._ensure_fresh()
+        # Cache vencido e última atualização com erro: o estado antigo não vale mais
+        if self._error and self._stale():
+            return None, self._error
+        return self._instances, None
+
+    def status(self, instance):
+        self._ensure_fresh()
+        if self._error and self._stale():
+            return {'status': 'error', 'error': self._error['error']}
+
+        status = self._statuses.get(instance)
+        if status is None:
+            return {'status': 'error', 'error': 'Instância não encontrada'}
+        return status
@@ -0,0 +1,35 @@
+import os
+
+import database
+from batch_writer import BatchWriter
+
+# Intervalo máximo entre a mudança de estado de um envio e sua gravação (segundos)
+FLUSH_INTERVAL = float(os.getenv('JOB_CHECKPOINT_INTERVAL', '2.0'))
+
+BATCH_SIZE = 100
+
+
+class JobCheckpointWriter(BatchWriter):
+    """Grava os checkpoints dos envios na tabela jobs em segundo plano.
+
+    Os envios enfileiram o próprio estado a cada frame de progresso; cada
+    lote mantém só o checkpoint mais recente de cada envio, então o custo
+    é de no máximo uma linha por envio a cada flush_interval.
+    """
+
+    name = 'job-checkpoints'
+
+    def __init__(self, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        super().__init__(batch_size, flush_interval)
+
+    def submit(self, record):
+        self.put(record)
+
+    def write_batch(self, batch):
+        latest = {}
+        for record in batch:
+            latest[record['job_id']] = record
+        database.save_job_checkpoints(list(latest.values()))
+
+
+job_checkpoints = JobCheckpointWriter()
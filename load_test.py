@@ -0,0 +1,177 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from fake_evolution import FakeEvolutionAPI
+
+# Rotas do dashboard medidas antes e durante os envios
+DASHBOARD_ROUTES = ('/', '/get-history?limit=50', '/list-templates', '/check-instance-status?instance=bench0')
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(latencies, elapsed):
+    return {
+        'requests': len(latencies),
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'max_ms': round(max(latencies) * 1000, 2),
+    }
+
+
+def measure(base_url, requests_count, concurrency, routes=DASHBOARD_ROUTES):
+    # Dispara requisições às rotas (em rodízio) e mede a latência de cada uma
+    local = threading.local()
+
+    def hit(index):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        route = routes[index % len(routes)]
+        started = time.perf_counter()
+        response = session.get(base_url + route, timeout=60)
+        response.raise_for_status()
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        latencies = list(executor.map(hit, range(requests_count)))
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def wait_ready(base_url, process, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('O servidor encerrou durante a inicialização')
+        try:
+            if requests.get(base_url + '/list-templates', timeout=1).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError('O servidor não respondeu a tempo')
+
+
+def start_server(api, port, database_path, async_mode='eventlet'):
+    # Sobe a aplicação (run.py) apontando para a Evolution API falsa
+    env = dict(os.environ,
+               ASYNC_MODE=async_mode,
+               HOST='127.0.0.1',
+               PORT=str(port),
+               SERVER_URL=api.address,
+               EVOLUTION_SCHEME='http',
+               API_KEY='load-test',
+               DATABASE_PATH=database_path,
+               HISTORY_RETENTION_DAYS='0')
+    server = subprocess.Popen([sys.executable, 'run.py'], env=env,
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f'http://127.0.0.1:{port}'
+    try:
+        wait_ready(base_url, server)
+    except Exception:
+        stop_server(server)
+        raise
+    return server, base_url
+
+
+def stop_server(server):
+    server.terminate()
+    server.wait(timeout=10)
+
+
+def run(args):
+    api = FakeEvolutionAPI(latency=args.api_latency).start()
+    workdir = tempfile.mkdtemp(prefix='load-test-')
+    server, base_url = start_server(api, args.port, os.path.join(workdir, 'messages.db'),
+                                    args.async_mode)
+    try:
+        template = requests.post(base_url + '/add-template',
+                                 json={'name': 'load-test', 'content': 'Mensagem de teste de carga'}).json()
+
+        baseline = measure(base_url, args.requests, args.concurrency)
+
+        # Envios rodando em segundo plano enquanto o dashboard é consultado
+        started = time.time()
+        jobs = []
+        for index in range(args.jobs):
+            numbers = [f'55119{index:02d}{n:06d}' for n in range(args.numbers)]
+            response = requests.post(base_url + '/send-messages', json={
+                'numbers': numbers,
+                'template_id': template['id'],
+                'instance': 'bench0',
+                'delay_range': [0, 0],
+            }).json()
+            jobs.append(response['job_id'])
+
+        during = measure(base_url, args.requests, args.concurrency)
+
+        # Aguarda os envios terminarem para medir a vazão
+        sent = 0
+        for job_id in jobs:
+            while True:
+                snapshot = requests.get(f'{base_url}/send-progress/{job_id}').json()
+                if snapshot['status'] != 'running':
+                    sent += snapshot['progress']['current']
+                    break
+                time.sleep(0.2)
+        job_seconds = time.time() - started
+
+        return {
+            'async_mode': args.async_mode,
+            'api_latency_ms': args.api_latency * 1000,
+            'concurrency': args.concurrency,
+            'baseline': baseline,
+            'during_jobs': during,
+            'p99_ratio': round(during['p99_ms'] / baseline['p99_ms'], 2) if baseline['p99_ms'] else None,
+            'jobs': {
+                'count': args.jobs,
+                'messages_sent': sent,
+                'seconds': round(job_seconds, 2),
+                'messages_per_second': round(sent / job_seconds, 1) if job_seconds else None,
+            },
+        }
+    finally:
+        stop_server(server)
+        api.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Teste de carga: latência do dashboard com e sem envios em andamento')
+    parser.add_argument('--async-mode', default='eventlet', choices=('eventlet', 'threading'))
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--api-latency', type=float, default=0.05,
+                        help='Latência da Evolution API falsa (segundos)')
+    parser.add_argument('--jobs', type=int, default=2, help='Envios simultâneos')
+    parser.add_argument('--numbers', type=int, default=200, help='Números por envio')
+    parser.add_argument('--requests', type=int, default=400, help='Requisições ao dashboard por fase')
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--output', help='Arquivo JSON com o resultado')
+    args = parser.parse_args(argv)
+
+    result = run(args)
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            output.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
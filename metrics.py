@@ -0,0 +1,342 @@
+import bisect
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import request
+
+import cooperative
+from app_log import log_event
+
+# Buckets padrão de latência (segundos)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # Lock nativo: as métricas também são atualizadas nas threads do tpool
+        self._lock = cooperative.native_lock()
+        self._children = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}',
+                 f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            children = sorted(self._children.items())
+        for key, child in children:
+            lines.extend(self._render_child(key, child))
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._children[key] = self._children.get(key, 0) + amount
+
+    def _render_child(self, key, value):
+        yield f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        # Gauges com callback são calculados somente no momento da coleta
+        self.callback = callback
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._children[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._children[key] = self._children.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def render(self):
+        if self.callback is not None:
+            try:
+                self.set(self.callback())
+            except Exception:
+                log_event('metric_callback_error', logging.ERROR, exc_info=True, metric=self.name)
+        return super().render()
+
+    def _render_child(self, key, value):
+        yield f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+
+
+class _HistogramChild:
+    __slots__ = ('counts', 'count', 'sum', 'max')
+
+    def __init__(self, size):
+        self.counts = [0] * size
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = _HistogramChild(len(self.buckets) + 1)
+            child.counts[index] += 1
+            child.count += 1
+            child.sum += value
+            if value > child.max:
+                child.max = value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _quantile(self, child, q):
+        # Aproximação pelo limite superior do bucket que contém o quantil
+        if not child.count:
+            return None
+        target = q * child.count
+        seen = 0
+        for index, bucket_count in enumerate(child.counts):
+            seen += bucket_count
+            if seen >= target:
+                return self.buckets[index] if index < len(self.buckets) else child.max
+        return child.max
+
+    def snapshot(self):
+        # Resumo legível dos histogramas (contagem, média, máximo e quantis)
+        with self._lock:
+            children = sorted(self._children.items())
+            result = []
+            for key, child in children:
+                entry = dict(zip(self.labelnames, key))
+                entry.update({
+                    'count': child.count,
+                    'avg': child.sum / child.count if child.count else None,
+                    'max': child.max,
+                    'p50': self._quantile(child, 0.5),
+                    'p90': self._quantile(child, 0.9),
+                    'p99': self._quantile(child, 0.99),
+                    'buckets': dict(zip([_format_value(b) for b in self.buckets] + ['+Inf'],
+                                        child.counts)),
+                })
+                result.append(entry)
+        return result
+
+    def _render_child(self, key, child):
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), child.counts):
+            cumulative += bucket_count
+            labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+            yield f'{self.name}_bucket{labels} {cumulative}'
+        labels = _format_labels(self.labelnames, key)
+        yield f'{self.name}_sum{labels} {_format_value(child.sum)}'
+        yield f'{self.name}_count{labels} {child.count}'
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = cooperative.native_lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def counter(name, documentation, labelnames=()):
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name, documentation, labelnames=(), callback=None):
+    return REGISTRY.register(Gauge(name, documentation, labelnames, callback))
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+# Coletores da aplicação
+
+HTTP_REQUEST_DURATION = histogram(
+    'http_request_duration_seconds', 'Tempo de resposta das rotas Flask',
+    ('route', 'method', 'status'))
+
+EVOLUTION_REQUEST_DURATION = histogram(
+    'evolution_api_request_duration_seconds', 'Latência das chamadas à Evolution API',
+    ('method', 'endpoint', 'status'))
+
+SQLITE_QUERY_DURATION = histogram(
+    'sqlite_query_duration_seconds', 'Tempo das operações SQLite por statement',
+    ('statement',))
+
+SQLITE_COMMIT_DURATION = histogram(
+    'sqlite_commit_duration_seconds', 'Tempo dos commits SQLite por statement',
+    ('statement',))
+
+SOCKETIO_EMITS = counter(
+    'socketio_emits_total', 'Eventos emitidos pelo Socket.IO', ('event',))
+
+BACKGROUND_TASKS_RUNNING = gauge(
+    'background_tasks_running', 'Tarefas em segundo plano em execução', ('task',))
+
+BACKGROUND_TASK_DURATION = histogram(
+    'background_task_duration_seconds', 'Duração das tarefas em segundo plano',
+    ('task', 'outcome'), buckets=(1, 10, 60, 300, 900, 1800, 3600, 7200, 21600))
+
+
+def timed_query(statement):
+    # Decorator que mede o tempo de uma função de acesso ao banco
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with SQLITE_QUERY_DURATION.time(statement=statement):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def track_task(task):
+    # Decorator que conta as tarefas em execução e mede sua duração
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            BACKGROUND_TASKS_RUNNING.inc(task=task)
+            started = time.perf_counter()
+            outcome = 'error'
+            try:
+                result = func(*args, **kwargs)
+                outcome = 'success'
+                return result
+            finally:
+                BACKGROUND_TASKS_RUNNING.dec(task=task)
+                BACKGROUND_TASK_DURATION.observe(time.perf_counter() - started,
+                                                 task=task, outcome=outcome)
+        return wrapper
+    return decorator
+
+
+def instrument_route(func, route):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = func(*args, **kwargs)
+            status = _response_status(response)
+            return response
+        finally:
+            HTTP_REQUEST_DURATION.observe(time.perf_counter() - started,
+                                          route=route, method=request.method, status=status)
+    return wrapper
+
+
+def _response_status(response):
+    if isinstance(response, tuple) and len(response) > 1 and isinstance(response[1], int):
+        return response[1]
+    return getattr(response, 'status_code', 200)
+
+
+def instrument_app(app, exclude=('static',)):
+    # Envolve todas as rotas já registradas com a medição de tempo
+    for rule in app.url_map.iter_rules():
+        if rule.endpoint in exclude:
+            continue
+        view = app.view_functions[rule.endpoint]
+        if getattr(view, '_instrumented', False):
+            continue
+        wrapped = instrument_route(view, rule.rule)
+        wrapped._instrumented = True
+        app.view_functions[rule.endpoint] = wrapped
+
+
+def instrument_socketio(socketio):
+    # Conta cada emit por nome de evento
+    emit = socketio.emit
+
+    @functools.wraps(emit)
+    def counted_emit(event, *args, **kwargs):
+        SOCKETIO_EMITS.inc(event=event)
+        return emit(event, *args, **kwargs)
+
+    socketio.emit = counted_emit
+    return socketio
+
+
+def cached(func, ttl):
+    # Reaproveita o último valor por ttl segundos (para callbacks caros)
+    state = {'value': None, 'expires': 0.0}
+    lock = threading.Lock()
+
+    @functools.wraps(func)
+    def wrapper():
+        with lock:
+            now = time.monotonic()
+            if now >= state['expires']:
+                state['value'] = func()
+                state['expires'] = now + ttl
+            return state['value']
+    return wrapper
+
+
+def render():
+    return REGISTRY.render()
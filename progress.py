@@ -0,0 +1,249 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+# Intervalo mínimo entre frames de progresso (segundos)
+FLUSH_INTERVAL = float(os.getenv('PROGRESS_FLUSH_INTERVAL', '1.0'))
+
+# Quantidade de resultados que força o envio de um frame
+MAX_BATCH = int(os.getenv('PROGRESS_MAX_BATCH', '50'))
+
+# Resultados recentes mantidos para o snapshot de cada envio
+SNAPSHOT_RESULTS = 200
+
+# Quantidade de envios mantidos em memória para consulta
+MAX_JOBS = 50
+
+
+def job_room(job_id):
+    return f'job:{job_id}'
+
+
+# Status de um envio que não está mais em andamento
+FINISHED_STATUSES = ('completed', 'cancelled', 'failed', 'interrupted')
+
+
+class JobProgress:
+    """Acumula o progresso de um envio e emite frames agrupados.
+
+    Em vez de um 'send_result' e um 'send_progress' por destinatário, os
+    resultados são reunidos e enviados num único evento 'send_batch' a cada
+    flush_interval ou max_batch resultados, apenas para a sala do envio.
+    A cada frame (e ao concluir) o estado é repassado a `checkpoint`, que o
+    persiste em segundo plano.
+    """
+
+    def __init__(self, socketio, job_id, instance, total,
+                 flush_interval=FLUSH_INTERVAL, max_batch=MAX_BATCH, checkpoint=None):
+        self.socketio = socketio
+        self.checkpoint = checkpoint
+        self.job_id = job_id
+        self.room = job_room(job_id)
+        self.instance = instance
+        self.total = total
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._pending = []
+        self._recent = deque(maxlen=SNAPSHOT_RESULTS)
+        self._last_flush = 0.0
+        self.status = 'running'
+        self.current = 0
+        self.success_count = 0
+        self.error_count = 0
+        self.suppressed_count = 0
+        self.last_number = None
+        self.elapsed_time = 0
+        self.started_at = time.time()
+        self.updated_at = self.started_at
+        self.finished_at = None
+        self.summary = None
+        self._cancel = threading.Event()
+
+    def add_result(self, result):
+        with self._lock:
+            self.current += 1
+            # Posição no envio: permite ao cliente juntar frames e snapshot sem repetir
+            result = dict(result, index=self.current)
+            if result['status'] == 'success':
+                self.success_count += 1
+            elif result['status'] == 'suppressed':
+                self.suppressed_count += 1
+            else:
+                self.error_count += 1
+            self.last_number = result['number']
+            self.elapsed_time = result.get('total_time', self.elapsed_time)
+            self.updated_at = time.time()
+            self._pending.append(result)
+            self._recent.append(result)
+            due = (len(self._pending) >= self.max_batch or
+                   time.monotonic() - self._last_flush >= self.flush_interval)
+        if due:
+            self.flush()
+
+    def _progress(self):
+        return {
+            'current': self.current,
+            'total': self.total,
+            'number': self.last_number,
+            'elapsed_time': self.elapsed_time
+        }
+
+    def flush(self):
+        with self._lock:
+            if not self._pending:
+                return
+            frame = {
+                'job_id': self.job_id,
+                'results': self._pending,
+                'progress': self._progress()
+            }
+            self._pending = []
+            self._last_flush = time.monotonic()
+        self.socketio.emit('send_batch', frame, to=self.room)
+        self._checkpoint()
+
+    def emit(self, event, data):
+        # Eventos pontuais (erro, conclusão) vão apenas para a sala do envio
+        self.socketio.emit(event, dict(data, job_id=self.job_id), to=self.room)
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def cancel(self):
+        # Pede o cancelamento; o envio para antes do próximo número
+        if self.status != 'running':
+            return False
+        self._cancel.set()
+        return True
+
+    def sleep(self, seconds):
+        # Espera o delay entre envios, interrompida por um cancelamento.
+        # Retorna True se o envio foi cancelado. O que estiver pendente é
+        # publicado antes, para não ficar parado durante o delay
+        self.flush()
+        return self._cancel.wait(seconds)
+
+    def complete(self, summary, error=None):
+        # Com error o envio terminou por uma falha inesperada da tarefa
+        self.flush()
+        with self._lock:
+            if error is not None:
+                self.status = 'failed'
+                summary = dict(summary, error=error)
+            else:
+                self.status = 'cancelled' if self.cancelled else 'completed'
+            self.summary = dict(summary, status=self.status)
+            self.updated_at = self.finished_at = time.time()
+        self._checkpoint()
+        self.emit('send_complete', self.summary)
+
+    def _checkpoint(self):
+        if self.checkpoint is not None:
+            self.checkpoint(self.record())
+
+    def record(self):
+        # Estado persistido na tabela jobs
+        with self._lock:
+            return {
+                'job_id': self.job_id,
+                'instance_name': self.instance,
+                'status': self.status,
+                'total': self.total,
+                'current': self.current,
+                'success_count': self.success_count,
+                'error_count': self.error_count,
+                'suppressed_count': self.suppressed_count,
+                'last_number': self.last_number,
+                'elapsed_time': self.elapsed_time,
+                'started_at': self.started_at,
+                'updated_at': self.updated_at,
+                'finished_at': self.finished_at,
+                'summary': self.summary,
+            }
+
+    @classmethod
+    def from_record(cls, record):
+        # Envio restaurado do banco na inicialização (já encerrado, sem emitir eventos)
+        job = cls(None, record['job_id'], record['instance_name'], record['total'])
+        for field in ('status', 'current', 'success_count', 'error_count', 'suppressed_count',
+                      'last_number', 'elapsed_time', 'started_at', 'updated_at',
+                      'finished_at', 'summary'):
+            setattr(job, field, record[field])
+        job.elapsed_time = job.elapsed_time or 0
+        return job
+
+    def info(self):
+        # Resumo do envio, sem a lista de resultados (para listagens)
+        with self._lock:
+            return {
+                'job_id': self.job_id,
+                'instance': self.instance,
+                'status': self.status,
+                'cancel_requested': self.cancelled and self.status == 'running',
+                'total': self.total,
+                'success_count': self.success_count,
+                'error_count': self.error_count,
+                'suppressed_count': self.suppressed_count,
+                'progress': self._progress(),
+                'started_at': self.started_at,
+                'updated_at': self.updated_at,
+                'finished_at': self.finished_at,
+                'summary': self.summary
+            }
+
+    def snapshot(self):
+        snapshot = self.info()
+        with self._lock:
+            snapshot['recent_results'] = list(self._recent)
+        return snapshot
+
+
+class ProgressRegistry:
+    """Envios recentes mantidos em memória, dos quais as rotas respondem.
+
+    O checkpoint recebido é repassado a cada envio criado; na inicialização,
+    load() restaura os envios gravados anteriormente.
+    """
+
+    def __init__(self, max_jobs=MAX_JOBS, checkpoint=None):
+        self.max_jobs = max_jobs
+        self.checkpoint = checkpoint
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+
+    def create(self, socketio, instance, total):
+        job_id = uuid.uuid4().hex
+        job = JobProgress(socketio, job_id, instance, total, checkpoint=self.checkpoint)
+        self._add(job)
+        job._checkpoint()
+        return job
+
+    def _add(self, job):
+        with self._lock:
+            self._jobs[job.job_id] = job
+            # Descarta os envios concluídos mais antigos
+            finished = [key for key, item in self._jobs.items() if item.status != 'running']
+            for key in finished[:max(0, len(self._jobs) - self.max_jobs)]:
+                del self._jobs[key]
+
+    def load(self, records):
+        # Registros do mais antigo para o mais recente, preservando a ordem de criação
+        for record in sorted(records, key=lambda record: record['started_at']):
+            self._add(JobProgress.from_record(record))
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self, status=None):
+        # Envios do mais recente para o mais antigo
+        with self._lock:
+            jobs = list(reversed(self._jobs.values()))
+        return [job.info() for job in jobs if status is None or job.status == status]
+
+
+progress_registry = ProgressRegistry()
@@ -0,0 +1,99 @@
+import os
+import threading
+import time
+from collections import deque
+
+import database
+
+# Linhas mais recentes do histórico mantidas em memória (primeira página do dashboard)
+RECENT_HISTORY_SIZE = int(os.getenv('RECENT_HISTORY_SIZE', '200'))
+
+
+class RecentHistory:
+    """Buffer circular com as linhas mais recentes do histórico.
+
+    É carregado do banco uma vez e alimentado pelo HistoryWriter a cada lote
+    gravado (e pelos recibos de entrega), de modo que a primeira página do
+    histórico é servida sem consultar o SQLite.
+    """
+
+    def __init__(self, size=RECENT_HISTORY_SIZE):
+        self.size = size
+        self._lock = threading.Lock()
+        self._rows = deque(maxlen=size)
+        self._by_message_id = {}
+        # Verdadeiro enquanto o buffer contém todas as linhas da tabela
+        self._exhaustive = False
+        self._loaded = False
+
+    def load(self):
+        rows, next_cursor = database.get_history_page(limit=self.size)
+        with self._lock:
+            self._rows.clear()
+            self._by_message_id.clear()
+            for row in reversed(rows):
+                self._append(row)
+            self._exhaustive = next_cursor is None
+            self._loaded = True
+
+    def clear(self):
+        with self._lock:
+            self._rows.clear()
+            self._by_message_id.clear()
+            self._exhaustive = True
+            self._loaded = True
+
+    def _append(self, row):
+        if len(self._rows) == self._rows.maxlen:
+            evicted = self._rows[0]
+            self._by_message_id.pop(evicted.get('message_id'), None)
+            self._exhaustive = False
+        self._rows.append(row)
+        if row.get('message_id'):
+            self._by_message_id[row['message_id']] = row
+
+    def extend(self, rows):
+        # Linhas recém-gravadas por database.save_message_history_batch (já com id)
+        now = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+        with self._lock:
+            if not self._loaded:
+                return
+            for row in rows:
+                entry = {'id': row['id']}
+                entry.update({column: row.get(column) for column in database.HISTORY_COLUMNS})
+                entry['sent_date'] = entry['sent_date'] or now
+                self._append(entry)
+
+    def apply_receipts(self, receipts):
+        # Mantém o status de entrega das linhas em memória igual ao do banco
+        rank = database.DELIVERY_STATUS_RANK
+        with self._lock:
+            for receipt in receipts:
+                row = self._by_message_id.get(receipt['message_id'])
+                if row is None:
+                    continue
+                current = row.get('delivery_status')
+                if current is None or rank.get(receipt['status'], 0) >= rank.get(current, 0):
+                    row['delivery_status'] = receipt['status']
+
+    def page(self, limit):
+        """Primeira página do histórico, no formato de get_history_page.
+
+        Retorna None quando o buffer não tem linhas suficientes para
+        responder sozinho; nesse caso a consulta vai ao banco.
+        """
+        with self._lock:
+            if not self._loaded or limit > self.size:
+                return None
+            if len(self._rows) < limit and not self._exhaustive:
+                return None
+            rows = sorted(self._rows, key=lambda row: (row['sent_date'], row['id']), reverse=True)
+            exhaustive = self._exhaustive
+            rows = [dict(row) for row in rows[:limit + 1]]
+
+        has_more = len(rows) > limit or (not exhaustive and len(rows) == limit)
+        next_cursor = database.encode_history_cursor(rows[limit - 1]) if has_more else None
+        return rows[:limit], next_cursor
+
+
+recent_history = RecentHistory()
@@ -0,0 +1,157 @@
+import argparse
+import glob
+import gzip
+import json
+import logging
+import os
+import sys
+
+from dotenv import load_dotenv
+
+import database
+from app_log import log_event
+from recent_history import recent_history
+
+# Dias mantidos na tabela message_history (0 desativa o arquivamento automático)
+RETENTION_DAYS = int(os.getenv('HISTORY_RETENTION_DAYS', '0'))
+
+# Diretório dos arquivos de histórico arquivado
+ARCHIVE_DIR = os.getenv('HISTORY_ARCHIVE_DIR', 'archive')
+
+# Intervalo entre execuções automáticas do arquivamento (segundos)
+ARCHIVE_INTERVAL = float(os.getenv('HISTORY_ARCHIVE_INTERVAL', str(24 * 3600)))
+
+ARCHIVE_CHUNK_SIZE = 5000
+
+ARCHIVE_PREFIX = 'message_history-'
+ARCHIVE_SUFFIX = '.ndjson.gz'
+
+
+def archive_path(archive_dir, day, first_id):
+    # Um arquivo por dia e bloco, nomeado pelo primeiro id: arquivar de novo o
+    # mesmo bloco (se a remoção do banco falhou) sobrescreve em vez de duplicar
+    return os.path.join(archive_dir, f'{ARCHIVE_PREFIX}{day}-{first_id:010d}{ARCHIVE_SUFFIX}')
+
+
+def archive_day(path):
+    # Dia de envio a partir do nome do arquivo (message_history-YYYY-MM-DD[-id].ndjson.gz)
+    return os.path.basename(path)[len(ARCHIVE_PREFIX):len(ARCHIVE_PREFIX) + 10]
+
+
+def archive_history(days=RETENTION_DAYS, archive_dir=ARCHIVE_DIR, chunk_size=ARCHIVE_CHUNK_SIZE):
+    """Move para arquivos compactados as linhas com mais de `days` dias.
+
+    As linhas são gravadas em arquivos NDJSON gzip por dia de envio (com o
+    texto completo da mensagem) e só então removidas do banco, bloco a bloco.
+    Cada arquivo é escrito num temporário e renomeado, e uma nova execução
+    após uma falha reescreve os mesmos arquivos, sem duplicar linhas.
+    Os agregados de history_stats não são alterados.
+    """
+    if days <= 0:
+        raise ValueError('O período de retenção deve ser maior que zero')
+
+    os.makedirs(archive_dir, exist_ok=True)
+    cutoff = database.retention_cutoff(days)
+    archived = 0
+
+    while True:
+        rows = database.get_history_before(cutoff, chunk_size)
+        if not rows:
+            break
+
+        by_day = {}
+        for row in rows:
+            by_day.setdefault(str(row['sent_date'])[:10], []).append(row)
+        for day, day_rows in by_day.items():
+            path = archive_path(archive_dir, day, day_rows[0]['id'])
+            with gzip.open(path + '.tmp', 'wt', encoding='utf-8') as archive:
+                for row in day_rows:
+                    archive.write(json.dumps(row, ensure_ascii=False) + '\n')
+            os.replace(path + '.tmp', path)
+
+        database.delete_history_rows([row['id'] for row in rows])
+        archived += len(rows)
+
+    if archived:
+        database.delete_orphan_message_bodies()
+    return archived
+
+
+def iter_archive(archive_dir=ARCHIVE_DIR, instance=None, status=None, date_from=None, date_to=None):
+    # Percorre os arquivos do período pedido (date_to exclusivo), linha a linha
+    paths = sorted(glob.glob(os.path.join(archive_dir, f'{ARCHIVE_PREFIX}*{ARCHIVE_SUFFIX}')))
+    for path in paths:
+        day = archive_day(path)
+        if date_from and day < date_from[:10]:
+            continue
+        if date_to and day > date_to[:10]:
+            continue
+
+        with gzip.open(path, 'rt', encoding='utf-8') as archive:
+            for line in archive:
+                row = json.loads(line)
+                if instance and row['instance_name'] != instance:
+                    continue
+                if status and row['status'] != status:
+                    continue
+                if date_from and row['sent_date'] < date_from:
+                    continue
+                if date_to and row['sent_date'] >= date_to:
+                    continue
+                yield row
+
+
+def run_scheduler(socketio, days=RETENTION_DAYS, interval=ARCHIVE_INTERVAL):
+    # Tarefa em segundo plano que aplica a política de retenção periodicamente
+    while True:
+        try:
+            archived = archive_history(days)
+            if archived:
+                log_event('history_archived', rows=archived, days=days)
+                # As linhas arquivadas podem estar no buffer da primeira página
+                recent_history.load()
+        except Exception:
+            log_event('history_archive_error', logging.ERROR, exc_info=True)
+        socketio.sleep(interval)
+
+
+def main(argv=None):
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description='Retenção e arquivamento do histórico de envios')
+    parser.add_argument('--archive-dir', default=ARCHIVE_DIR, help='Diretório dos arquivos')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    archive_parser = subparsers.add_parser('archive', help='Arquiva registros antigos')
+    archive_parser.add_argument('--days', type=int, default=RETENTION_DAYS or None, required=not RETENTION_DAYS,
+                                help='Mantém no banco apenas os últimos N dias')
+
+    query_parser = subparsers.add_parser('query', help='Consulta o histórico arquivado (NDJSON)')
+    query_parser.add_argument('--instance', help='Filtra por instância')
+    query_parser.add_argument('--status', help='Filtra por status')
+    query_parser.add_argument('--date-from', help='Data inicial (YYYY-MM-DD[ HH:MM:SS])')
+    query_parser.add_argument('--date-to', help='Data final, exclusiva (YYYY-MM-DD[ HH:MM:SS])')
+
+    subparsers.add_parser('dedupe', help='Move o texto das mensagens antigas para message_bodies')
+    subparsers.add_parser('reindex', help='Reconstrói o índice da busca no histórico')
+    args = parser.parse_args(argv)
+
+    database.init_db()
+
+    if args.command == 'archive':
+        archived = archive_history(args.days, args.archive_dir)
+        print(f'{archived} registros arquivados em {args.archive_dir}')
+    elif args.command == 'query':
+        for row in iter_archive(args.archive_dir, args.instance, args.status,
+                                args.date_from, args.date_to):
+            sys.stdout.write(json.dumps(row, ensure_ascii=False) + '\n')
+    elif args.command == 'dedupe':
+        converted = database.compact_message_bodies()
+        print(f'{converted} registros convertidos para mensagens deduplicadas')
+    elif args.command == 'reindex':
+        database.rebuild_history_search()
+        print('Índice de busca do histórico reconstruído')
+
+
+if __name__ == '__main__':
+    main()
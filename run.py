@@ -1,102 +1,131 @@
-from flask import Flask, render_template, request, jsonify
-from flask_socketio import SocketIO, emit
-import requests
+# Carrega as variáveis de ambiente do arquivo .env
+# (antes dos demais módulos, que leem suas configurações ao serem importados)
+from dotenv import load_dotenv
+load_dotenv()
+
+# No modo eventlet, sockets, sleep e locks passam a ser cooperativos;
+# precisa acontecer antes dos imports de flask, requests e threading
+import cooperative
+cooperative.monkey_patch()
+
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context
+from flask_socketio import SocketIO, emit, join_room
+import atexit
+import hashlib
+import hmac
 import json
+import logging
+import queue
 import os
 import time
 import random
-import sqlite3
-from dotenv import load_dotenv
 
-# Carrega as variáveis de ambiente do arquivo .env
-load_dotenv()
+import app_log
+import database
+import metrics
+import retention
+from app_log import log_event
+from evolution_client import EvolutionClient
+from export_history import csv_chunks, export_filename
+from history_writer import history_writer
+from instance_poller import InstancePoller
+from job_store import job_checkpoints
+from progress import job_room, progress_registry
+from recent_history import recent_history
+from suppression import normalize_number, suppression_list
+from template_cache import template_cache
+from webhooks import WEBHOOK_TOKEN, parse_receipts, receipt_writer
+
+# Logs estruturados em JSON, gravados por uma thread própria
+app_log.setup()
 
 app = Flask(__name__)
-socketio = SocketIO(app)
+socketio = metrics.instrument_socketio(SocketIO(app, async_mode=cooperative.ASYNC_MODE))
 
 # Configurações da API
 SERVER_URL = os.getenv('SERVER_URL')
 API_KEY = os.getenv('API_KEY')
-HEADERS = {
-    'Content-Type': 'application/json',
-    'apikey': API_KEY
-}
-
-# Configuração do banco de dados
-DATABASE = 'messages.db'
-
-def init_db():
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS message_templates
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  name TEXT NOT NULL,
-                  content TEXT NOT NULL)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS message_history
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  instance_name TEXT NOT NULL,
-                  number TEXT NOT NULL,
-                  message TEXT NOT NULL,
-                  status TEXT NOT NULL,
-                  error TEXT,
-                  sent_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                  delay INTEGER,
-                  total_time INTEGER)''')
-    conn.commit()
-    conn.close()
+
+# Cliente HTTP compartilhado (keep-alive, timeouts e retry) para a Evolution API
+evolution = EvolutionClient(SERVER_URL, API_KEY)
+atexit.register(evolution.close)
+
+# Estado das instâncias atualizado em segundo plano
+instance_poller = InstancePoller(socketio, evolution)
 
 # Inicializa o banco de dados
-init_db()
+database.init_db()
+template_cache.load()
+suppression_list.load()
+recent_history.load()
+
+# Inicia a gravação do histórico em segundo plano e garante o flush ao encerrar
+history_writer.start()
+atexit.register(history_writer.stop)
+receipt_writer.start()
+atexit.register(receipt_writer.stop)
+
+# Envios que estavam em andamento quando o processo parou ficam como interrompidos;
+# os mais recentes voltam para o registro em memória
+interrupted_jobs = database.mark_interrupted_jobs()
+if interrupted_jobs:
+    log_event('jobs_interrupted', logging.WARNING, count=interrupted_jobs)
+progress_registry.load(database.list_jobs(progress_registry.max_jobs))
+progress_registry.checkpoint = job_checkpoints.submit
+job_checkpoints.start()
+atexit.register(job_checkpoints.stop)
+
+# Arquiva periodicamente o histórico antigo, se houver política de retenção
+if retention.RETENTION_DAYS > 0:
+    socketio.start_background_task(retention.run_scheduler, socketio)
+
+# Métricas calculadas no momento da coleta
+metrics.gauge('message_history_rows', 'Linhas na tabela message_history',
+              callback=metrics.cached(database.count_history, ttl=60))
+metrics.gauge('history_writer_queue_depth', 'Linhas aguardando gravação no histórico',
+              callback=history_writer.depth)
+metrics.gauge('receipt_writer_queue_depth', 'Recibos de entrega aguardando gravação',
+              callback=receipt_writer.depth)
+metrics.gauge('log_records_dropped', 'Registros de log descartados com a fila cheia',
+              callback=app_log.dropped)
+
+def cached_json(payload, etag):
+    # Responde 304 quando o cliente já possui a versão atual (If-None-Match)
+    response = jsonify(payload)
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+# O HTML do dashboard não depende de dados (templates e histórico vêm das
+# rotas JSON), então é renderizado uma vez e servido com ETag
+_dashboard_shell = None
+
+def dashboard_shell():
+    global _dashboard_shell
+    # Em modo debug o template é renderizado de novo a cada requisição
+    if _dashboard_shell is None or app.debug:
+        html = render_template('dashboard.html')
+        _dashboard_shell = (html, hashlib.sha1(html.encode('utf-8')).hexdigest())
+    return _dashboard_shell
 
 @app.route('/')
 def index():
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    
-    # Busca templates
-    c.execute('SELECT * FROM message_templates')
-    templates = [{'id': row[0], 'name': row[1], 'content': row[2]} for row in c.fetchall()]
-    
-    # Busca histórico de envios (últimos 50)
-    c.execute('''SELECT instance_name, number, message, status, error, sent_date, delay, total_time 
-                 FROM message_history 
-                 ORDER BY sent_date DESC LIMIT 50''')
-    history = [{'instance_name': row[0],
-                'number': row[1],
-                'message': row[2],
-                'status': row[3],
-                'error': row[4],
-                'sent_date': row[5],
-                'delay': row[6],
-                'total_time': row[7]} for row in c.fetchall()]
-    
-    conn.close()
-    
-    return render_template('dashboard.html', 
-                         message_templates=templates,
-                         history=history)
+    html, etag = dashboard_shell()
+    response = Response(html, mimetype='text/html')
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+# Pré-renderiza o HTML do dashboard na inicialização
+with app.app_context():
+    dashboard_shell()
 
 @app.route('/fetch-instances')
 def fetch_instances():
-    try:
-        response = requests.get(
-            f'https://{SERVER_URL}/instance/fetchInstances',
-            headers=HEADERS
-        )
-        
-        if response.status_code == 200:
-            data = response.json()
-            # Garante que o retorno seja sempre uma lista
-            if not isinstance(data, list):
-                data = [data] if data else []
-            return jsonify(data)
-        else:
-            return jsonify({
-                'error': f'Erro ao buscar instâncias: {response.text}',
-                'status_code': response.status_code
-            })
-    except Exception as e:
-        return jsonify({'error': f'Erro ao buscar instâncias: {str(e)}'})
+    instances, error = instance_poller.instances()
+    if error:
+        return jsonify(error)
+    return jsonify(instances)
 
 @app.route('/check-instance-status')
 def check_instance_status():
@@ -105,80 +134,46 @@ def check_instance_status():
         return jsonify({'error': 'Instance name is required'})
     
     try:
-        # Primeiro busca as informações da instância
-        response = requests.get(
-            f'https://{SERVER_URL}/instance/fetchInstances',
-            headers=HEADERS
-        )
-        
-        if response.status_code != 200:
-            return jsonify({
-                'status': 'error',
-                'error': f'Erro ao buscar informações da instância: {response.text}'
-            })
-        
-        instances_data = response.json()
-        if not isinstance(instances_data, list):
-            instances_data = [instances_data] if instances_data else []
-        
-        # Procura a instância específica
-        instance_info = None
-        for item in instances_data:
-            if item.get('instance', {}).get('instanceName') == instance:
-                instance_info = item.get('instance', {})
-                break
-        
-        if not instance_info:
-            return jsonify({
-                'status': 'error',
-                'error': 'Instância não encontrada'
-            })
-        
-        # Agora verifica o estado da conexão
-        state_response = requests.get(
-            f'https://{SERVER_URL}/instance/connectionState/{instance}',
-            headers=HEADERS
-        )
-        
-        if state_response.status_code != 200:
-            return jsonify({
-                'status': 'error',
-                'error': f'Erro ao verificar estado da conexão: {state_response.text}'
-            })
-        
-        state_data = state_response.json()
-        
-        # Determina o status real da instância
-        instance_status = instance_info.get('status', 'unknown').upper()
-        connection_state = state_data.get('state', 'unknown').upper()
-        
-        # Se a instância está com status 'open', consideramos que está conectada
-        if instance_status == 'OPEN':
-            final_status = 'CONNECTED'
-        # Se está com status 'connecting', está tentando conectar
-        elif instance_status == 'CONNECTING':
-            final_status = 'CONNECTING'
-        # Se o estado da conexão indica que está conectada
-        elif connection_state == 'CONNECTED':
-            final_status = 'CONNECTED'
-        # Se está em qualquer outro estado, consideramos desconectada
-        else:
-            final_status = 'DISCONNECTED'
-        
-        # Retorna todas as informações relevantes
-        return jsonify({
-            'status': final_status,
-            'details': {
-                'owner': instance_info.get('owner'),
-                'profileName': instance_info.get('name'),
-                'connectionState': connection_state,
-                'instanceStatus': instance_status
-            }
-        })
-            
+        return jsonify(instance_poller.status(instance))
     except Exception as e:
         return jsonify({'status': 'error', 'error': str(e)})
 
+@socketio.on('connect')
+def handle_connect():
+    # O poller só começa a consultar a API quando há algum dashboard aberto
+    instance_poller.start()
+
+@socketio.on('join_job')
+def handle_join_job(data):
+    # O cliente passa a receber os frames de progresso do envio
+    job_id = (data or {}).get('job_id')
+    if job_id and progress_registry.get(job_id):
+        join_room(job_room(job_id))
+
+@app.route('/send-progress/<job_id>')
+@app.route('/jobs/<job_id>')
+def send_progress(job_id):
+    # Estado atual do envio em uma única resposta (para reconexões)
+    job = progress_registry.get(job_id)
+    if not job:
+        return jsonify({'error': 'Envio não encontrado'}), 404
+    return jsonify(job.snapshot())
+
+@app.route('/jobs')
+def list_jobs():
+    # Envios recentes, servidos do registro em memória
+    return jsonify({'jobs': progress_registry.list(request.args.get('status'))})
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    job = progress_registry.get(job_id)
+    if not job:
+        return jsonify({'error': 'Envio não encontrado'}), 404
+    if not job.cancel():
+        return jsonify({'error': f'O envio não está em andamento ({job.status})'}), 409
+    log_event('job_cancel_requested', job_id=job_id)
+    return jsonify({'success': True, 'job_id': job_id, 'status': 'cancelling'})
+
 @app.route('/validate-numbers', methods=['POST'])
 def validate_numbers():
     data = request.json
@@ -191,38 +186,35 @@ def validate_numbers():
         return jsonify({'error': 'É necessário selecionar uma instância'})
     
     try:
-        # Remove espaços e caracteres especiais dos números
-        cleaned_numbers = []
-        for number in numbers:
-            # Remove espaços, pontos e outros caracteres especiais
-            number = number.replace('.', '').replace('+', '').replace('-', '').replace(' ', '')
-            # Remove qualquer caractere que não seja dígito
-            cleaned = ''.join(filter(str.isdigit, number))
-            # Adiciona o código do país se não estiver presente
-            if len(cleaned) <= 13 and not cleaned.startswith('55'):
-                cleaned = '55' + cleaned
-            cleaned_numbers.append(cleaned)
+        # Mesma normalização da lista de supressão (só dígitos, com código do país)
+        cleaned_numbers = [cleaned for cleaned in map(normalize_number, numbers) if cleaned]
 
         # Remove números duplicados mantendo a ordem
         cleaned_numbers = list(dict.fromkeys(cleaned_numbers))
+        if not cleaned_numbers:
+            return jsonify({'error': 'Nenhum número fornecido'})
 
         # Monta o payload para a API
         payload = {
             'numbers': cleaned_numbers
         }
         
-        print(f"Validando números: {payload}")  # Debug
+        started = time.perf_counter()
         
         # Faz a requisição para validar os números
-        response = requests.post(
-            f'https://{SERVER_URL}/chat/whatsappNumbers/{instance}',
-            headers=HEADERS,
-            json=payload
+        response = evolution.post(
+            '/chat/whatsappNumbers/{instance}',
+            json=payload,
+            instance=instance
         )
         
-        print(f"Resposta da API: {response.text}")  # Debug
+        log_event('validate_numbers', instance=instance, numbers=cleaned_numbers,
+                  status_code=response.status_code,
+                  duration_ms=round((time.perf_counter() - started) * 1000, 1))
         
         if response.status_code != 200:
+            log_event('validate_numbers_failed', logging.WARNING, instance=instance,
+                      status_code=response.status_code, response=response.text)
             return jsonify({
                 'error': f'Erro ao validar números: {response.text}'
             })
@@ -255,21 +247,14 @@ def validate_numbers():
         })
         
     except Exception as e:
-        print(f"Erro ao validar números: {str(e)}")  # Debug
-        import traceback
-        traceback.print_exc()  # Imprime o stack trace completo
+        log_event('validate_numbers_error', logging.ERROR, exc_info=True, instance=instance)
         return jsonify({'error': f'Erro ao validar números: {str(e)}'})
 
 @app.route('/message-templates', methods=['GET', 'POST', 'PUT', 'DELETE'])
 def manage_templates():
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    
     try:
         if request.method == 'GET':
-            c.execute('SELECT * FROM message_templates')
-            templates = [{'id': row[0], 'name': row[1], 'content': row[2]} for row in c.fetchall()]
-            return jsonify(templates)
+            return cached_json(*template_cache.snapshot())
             
         elif request.method == 'POST':
             data = request.json
@@ -278,9 +263,7 @@ def manage_templates():
             if not name or not content:
                 return jsonify({'error': 'Nome e conteúdo são obrigatórios'}), 400
                 
-            c.execute('INSERT INTO message_templates (name, content) VALUES (?, ?)', (name, content))
-            template_id = c.lastrowid
-            conn.commit()
+            template_id = template_cache.create(name, content)
             
             return jsonify({'id': template_id, 'name': name, 'content': content})
             
@@ -293,9 +276,7 @@ def manage_templates():
             if not template_id or not name or not content:
                 return jsonify({'error': 'ID, nome e conteúdo são obrigatórios'}), 400
                 
-            c.execute('UPDATE message_templates SET name = ?, content = ? WHERE id = ?', 
-                     (name, content, template_id))
-            conn.commit()
+            template_cache.update(template_id, name, content)
             
             return jsonify({'id': template_id, 'name': name, 'content': content})
             
@@ -306,16 +287,14 @@ def manage_templates():
             if not template_id:
                 return jsonify({'error': 'ID do template é obrigatório'}), 400
                 
-            c.execute('DELETE FROM message_templates WHERE id = ?', (template_id,))
-            conn.commit()
+            template_cache.delete(template_id)
             
             return jsonify({'success': True})
             
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-        
-    finally:
-        conn.close()
 
 @app.route('/send-messages', methods=['POST'])
 def send_messages():
@@ -327,19 +306,24 @@ def send_messages():
     
     if not all([numbers, template_id, instance]):
         return jsonify({'error': 'Missing required parameters'}), 400
+    
+    # Intervalo de delay em segundos: [mínimo, máximo], inteiros, 0 <= mínimo <= máximo
+    if (not isinstance(delay_range, (list, tuple)) or len(delay_range) != 2
+            or not all(isinstance(value, int) and not isinstance(value, bool) for value in delay_range)
+            or not 0 <= delay_range[0] <= delay_range[1]):
+        return jsonify({'error': 'Invalid delay_range'}), 400
         
     try:
-        conn = sqlite3.connect(DATABASE)
-        c = conn.cursor()
-        
         # Busca o template
-        c.execute('SELECT content FROM message_templates WHERE id = ?', (template_id,))
-        template = c.fetchone()
+        template = template_cache.get(template_id)
         
         if not template:
             return jsonify({'error': 'Template not found'}), 404
             
-        message = template[0]
+        message = template['content']
+        
+        # Registra o envio; o progresso é publicado na sala do job
+        job = progress_registry.create(socketio, instance, len(numbers))
         
         # Inicia o envio em background
         socketio.start_background_task(
@@ -347,62 +331,231 @@ def send_messages():
             numbers=numbers,
             message=message,
             instance=instance,
-            delay_range=delay_range
+            delay_range=delay_range,
+            job=job
         )
         
-        return jsonify({'success': True})
+        return jsonify({'success': True, 'job_id': job.job_id})
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-        
-    finally:
-        conn.close()
 
 @app.route('/clear-history', methods=['POST'])
 def clear_history():
     try:
-        conn = sqlite3.connect(DATABASE)
-        c = conn.cursor()
-        
         # Limpa a tabela de histórico
-        c.execute('DELETE FROM message_history')
-        conn.commit()
+        database.clear_message_history()
+        recent_history.clear()
         
         return jsonify({'success': True})
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
-        
-    finally:
-        conn.close()
 
 @app.route('/get-history')
 def get_history():
+    filters = {
+        'instance': request.args.get('instance'),
+        'status': request.args.get('status'),
+        'date_from': request.args.get('date_from'),
+        'date_to': request.args.get('date_to'),
+    }
+    cursor = request.args.get('cursor')
+    
     try:
-        conn = sqlite3.connect(DATABASE)
-        c = conn.cursor()
+        # Modo streaming: uma linha JSON por registro, sem montar a lista em memória
+        if request.args.get('format') == 'ndjson':
+            if cursor:
+                database.decode_history_cursor(cursor)
+            
+            def generate():
+                for row in database.iter_history(cursor=cursor, **filters):
+                    yield json.dumps(row, ensure_ascii=False) + '\n'
+            
+            return Response(stream_with_context(generate()),
+                            mimetype='application/x-ndjson')
         
-        # Busca histórico de envios (ordenado por data mais recente)
-        c.execute('''SELECT instance_name, number, message, status, error, sent_date, delay, total_time 
-                     FROM message_history 
-                     ORDER BY sent_date DESC''')
+        # Busca uma página do histórico (ordenado por data mais recente)
+        limit = request.args.get('limit', database.HISTORY_PAGE_SIZE, type=int)
+        limit = max(1, min(limit, database.HISTORY_MAX_PAGE_SIZE))
         
-        history = [{'instance_name': row[0],
-                    'number': row[1],
-                    'message': row[2],
-                    'status': row[3],
-                    'error': row[4],
-                    'sent_date': row[5],
-                    'delay': row[6],
-                    'total_time': row[7]} for row in c.fetchall()]
+        # A primeira página sem filtros vem do buffer em memória, quando ele basta
+        page = None
+        if not cursor and not any(filters.values()):
+            page = recent_history.page(limit)
+        if page is None:
+            page = database.get_history_page(cursor=cursor, limit=limit, **filters)
+        history, next_cursor = page
         
-        return jsonify(history)
+        return jsonify({'items': history, 'next_cursor': next_cursor})
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+
+@app.route('/search-history')
+def search_history():
+    # Busca por fragmento de número, erro ou texto da mensagem, por relevância
+    try:
+        items, next_cursor = database.search_history(
+            request.args.get('q', ''),
+            cursor=request.args.get('cursor'),
+            limit=request.args.get('limit', database.HISTORY_PAGE_SIZE, type=int),
+            instance=request.args.get('instance'),
+            status=request.args.get('status'),
+            date_from=request.args.get('date_from'),
+            date_to=request.args.get('date_to'))
+
+        return jsonify({'items': items, 'next_cursor': next_cursor})
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/export-history')
+def export_history():
+    compress = request.args.get('gzip') in ('1', 'true')
+    
+    chunks = csv_chunks(compress=compress,
+                        instance=request.args.get('instance'),
+                        status=request.args.get('status'),
+                        date_from=request.args.get('date_from'),
+                        date_to=request.args.get('date_to'))
+    
+    return Response(stream_with_context(chunks),
+                    mimetype='application/gzip' if compress else 'text/csv',
+                    headers={'Content-Disposition': f'attachment; filename={export_filename(compress)}'})
+
+@app.route('/history-writer-status')
+def history_writer_status():
+    return jsonify(history_writer.stats())
+
+@app.route('/diagnostics/evolution-latency')
+def evolution_latency():
+    return jsonify(evolution.latency_stats())
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/history-stats')
+def history_stats():
+    # Agregados mantidos incrementalmente (não percorrem message_history)
+    group_by = [column.strip() for column in
+                request.args.get('group_by', 'day,instance_name,status,error_code').split(',')
+                if column.strip()]
+    
+    try:
+        rows = database.get_history_stats(group_by=group_by,
+                                          instance=request.args.get('instance'),
+                                          status=request.args.get('status'),
+                                          date_from=request.args.get('date_from'),
+                                          date_to=request.args.get('date_to'))
         
-    finally:
-        conn.close()
+        total = sum(row['count'] for row in rows)
+        success = sum(row['count'] for row in rows if row.get('status') == 'success')
+        
+        return jsonify({
+            'rows': rows,
+            'total': total,
+            'success_rate': round(success / total * 100, 1) if total and 'status' in group_by else None
+        })
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/archived-history')
+def archived_history():
+    # Consulta os arquivos de histórico antigo, em NDJSON
+    rows = retention.iter_archive(instance=request.args.get('instance'),
+                                  status=request.args.get('status'),
+                                  date_from=request.args.get('date_from'),
+                                  date_to=request.args.get('date_to'))
+    
+    def generate():
+        for row in rows:
+            yield json.dumps(row, ensure_ascii=False) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/suppression', methods=['GET', 'POST', 'DELETE'])
+def manage_suppression():
+    try:
+        if request.method == 'GET':
+            limit = max(1, min(request.args.get('limit', 100, type=int), 1000))
+            items = database.list_suppressed_numbers(after=request.args.get('after'),
+                                                     limit=limit,
+                                                     search=request.args.get('search'))
+            return jsonify({
+                'total': len(suppression_list),
+                'items': items,
+                'next': items[-1]['number'] if len(items) == limit else None
+            })
+        
+        data = request.get_json() or {}
+        numbers = data.get('numbers', [])
+        if not numbers:
+            return jsonify({'error': 'Nenhum número fornecido'}), 400
+        
+        if request.method == 'POST':
+            added = suppression_list.add(numbers, data.get('reason'))
+            return jsonify({'success': True, 'added': added, 'total': len(suppression_list)})
+        
+        removed = suppression_list.remove(numbers)
+        return jsonify({'success': True, 'removed': removed, 'total': len(suppression_list)})
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/suppression/check')
+def check_suppression():
+    number = request.args.get('number', '')
+    return jsonify({'number': number, 'suppressed': suppression_list.contains(number)})
+
+@app.route('/suppression/import', methods=['POST'])
+def import_suppression():
+    file = request.files.get('file')
+    if not file:
+        return jsonify({'error': 'Arquivo CSV é obrigatório'}), 400
+    
+    try:
+        result = suppression_list.import_csv(file.stream, request.form.get('reason'))
+        return jsonify(dict(result, success=True, total=len(suppression_list)))
+    except Exception:
+        log_event('suppression_import_error', logging.ERROR, exc_info=True)
+        return jsonify({'error': 'Erro ao importar lista de supressão'}), 500
+
+@app.route('/webhook/evolution', methods=['POST'])
+def evolution_webhook():
+    # Recebe as atualizações de status das mensagens enviadas pela Evolution API
+    if WEBHOOK_TOKEN:
+        token = request.args.get('token') or request.headers.get('X-Webhook-Token') or ''
+        if not hmac.compare_digest(token, WEBHOOK_TOKEN):
+            return jsonify({'error': 'Token inválido'}), 401
+    
+    payload = request.get_json(silent=True)
+    if payload is None:
+        return jsonify({'error': 'JSON inválido'}), 400
+    
+    # Apenas enfileira; a gravação é feita em lotes pelo receipt_writer
+    receipts = parse_receipts(payload)
+    try:
+        for receipt in receipts:
+            receipt_writer.put(receipt, block=False)
+    except queue.Full:
+        return jsonify({'error': 'Fila de recibos cheia, tente novamente'}), 503
+    
+    return jsonify({'accepted': len(receipts)})
+
+@app.route('/receipt-writer-status')
+def receipt_writer_status():
+    return jsonify(receipt_writer.stats())
 
 @app.route('/add-template', methods=['POST'])
 def add_template():
@@ -412,15 +565,7 @@ def add_template():
         if not data or 'name' not in data or 'content' not in data:
             return jsonify({'error': 'Nome e conteúdo são obrigatórios'}), 400
             
-        conn = sqlite3.connect(DATABASE)
-        c = conn.cursor()
-        
-        c.execute('INSERT INTO message_templates (name, content) VALUES (?, ?)',
-                 (data['name'], data['content']))
-        conn.commit()
-        
-        template_id = c.lastrowid
-        conn.close()
+        template_id = template_cache.create(data['name'], data['content'])
         
         return jsonify({
             'success': True,
@@ -428,8 +573,8 @@ def add_template():
             'message': 'Template criado com sucesso'
         })
         
-    except Exception as e:
-        print(f"Erro ao adicionar template: {str(e)}")
+    except Exception:
+        log_event('template_create_error', logging.ERROR, exc_info=True)
         return jsonify({'error': 'Erro ao salvar template'}), 500
 
 @app.route('/update-template/<int:template_id>', methods=['PUT'])
@@ -440,105 +585,100 @@ def update_template(template_id):
         if not data or 'name' not in data or 'content' not in data:
             return jsonify({'error': 'Nome e conteúdo são obrigatórios'}), 400
             
-        conn = sqlite3.connect(DATABASE)
-        c = conn.cursor()
-        
-        c.execute('UPDATE message_templates SET name = ?, content = ? WHERE id = ?',
-                 (data['name'], data['content'], template_id))
-        conn.commit()
+        updated = template_cache.update(template_id, data['name'], data['content'])
         
-        if c.rowcount == 0:
-            conn.close()
+        if updated == 0:
             return jsonify({'error': 'Template não encontrado'}), 404
             
-        conn.close()
         return jsonify({
             'success': True,
             'message': 'Template atualizado com sucesso'
         })
         
-    except Exception as e:
-        print(f"Erro ao atualizar template: {str(e)}")
+    except Exception:
+        log_event('template_update_error', logging.ERROR, exc_info=True)
         return jsonify({'error': 'Erro ao atualizar template'}), 500
 
 @app.route('/delete-template/<int:template_id>', methods=['DELETE'])
 def delete_template(template_id):
     try:
-        conn = sqlite3.connect(DATABASE)
-        c = conn.cursor()
-        
-        c.execute('DELETE FROM message_templates WHERE id = ?', (template_id,))
-        conn.commit()
+        deleted = template_cache.delete(template_id)
         
-        if c.rowcount == 0:
-            conn.close()
+        if deleted == 0:
             return jsonify({'error': 'Template não encontrado'}), 404
             
-        conn.close()
         return jsonify({
             'success': True,
             'message': 'Template excluído com sucesso'
         })
         
-    except Exception as e:
-        print(f"Erro ao excluir template: {str(e)}")
+    except Exception:
+        log_event('template_delete_error', logging.ERROR, exc_info=True)
         return jsonify({'error': 'Erro ao excluir template'}), 500
 
 @app.route('/get-template/<int:template_id>', methods=['GET'])
 def get_template(template_id):
     try:
-        conn = sqlite3.connect(DATABASE)
-        c = conn.cursor()
-        
-        c.execute('SELECT name, content FROM message_templates WHERE id = ?', (template_id,))
-        template = c.fetchone()
+        template = template_cache.get(template_id)
         
         if not template:
-            conn.close()
             return jsonify({'error': 'Template não encontrado'}), 404
             
-        conn.close()
         return jsonify({
-            'name': template[0],
-            'content': template[1]
+            'name': template['name'],
+            'content': template['content']
         })
         
-    except Exception as e:
-        print(f"Erro ao buscar template: {str(e)}")
+    except Exception:
+        log_event('template_get_error', logging.ERROR, exc_info=True)
         return jsonify({'error': 'Erro ao buscar template'}), 500
 
 @app.route('/list-templates', methods=['GET'])
 def list_templates():
     try:
-        conn = sqlite3.connect(DATABASE)
-        c = conn.cursor()
+        templates, etag = template_cache.snapshot(newest_first=True)
         
-        c.execute('SELECT id, name, content FROM message_templates ORDER BY id DESC')
-        templates = [{
-            'id': row[0],
-            'name': row[1],
-            'content': row[2]
-        } for row in c.fetchall()]
+        return cached_json(templates, etag)
         
-        conn.close()
-        return jsonify(templates)
-        
-    except Exception as e:
-        print(f"Erro ao listar templates: {str(e)}")
+    except Exception:
+        log_event('template_list_error', logging.ERROR, exc_info=True)
         return jsonify({'error': 'Erro ao listar templates'}), 500
 
-def send_messages_task(numbers, message, instance, delay_range):
-    total = len(numbers)
+@metrics.track_task('send_messages')
+def send_messages_task(numbers, message, instance, delay_range, job):
     current = 0
     success_count = 0
     error_count = 0
+    suppressed_count = 0
     start_time = time.time()  # Marca o início do envio
     
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    
+    # Falha inesperada da tarefa; o envio termina como 'failed', nunca fica 'running'
+    failure = 'Envio interrompido'
     try:
         for number in numbers:
+            # Cancelado pelo /jobs/<id>/cancel: para antes do próximo número
+            if job.cancelled:
+                break
+            
+            # Números na lista de supressão são registrados e pulados, sem delay
+            if suppression_list.contains(number):
+                elapsed_time = int(time.time() - start_time)
+                suppressed_count += 1
+                current += 1
+                history_writer.submit(instance, number, message, 'suppressed',
+                                      None, 0, elapsed_time)
+                job.add_result({
+                    'number': number,
+                    'status': 'suppressed',
+                    'error': None,
+                    'delay': 0,
+                    'total_time': elapsed_time
+                })
+                continue
+            
+            # Gera o delay aleatório antes de qualquer chamada que possa falhar
+            delay = random.randint(delay_range[0], delay_range[1])
+            
             try:
                 # Prepara o payload da mensagem
                 payload = {
@@ -552,26 +692,22 @@ def send_messages_task(numbers, message, instance, delay_range):
                     }
                 }
                 
-                print(f"Enviando mensagem para {number}. Payload: {payload}")  # Debug
-                
-                # Gera o delay aleatório
-                delay = random.randint(delay_range[0], delay_range[1])
-                
                 # Envia a mensagem
-                response = requests.post(
-                    f'https://{SERVER_URL}/message/sendText/{instance}',
-                    headers=HEADERS,
-                    json=payload
+                response = evolution.post(
+                    '/message/sendText/{instance}',
+                    json=payload,
+                    instance=instance
                 )
                 
-                print(f"Resposta da API: Status {response.status_code} - {response.text}")  # Debug
-                
                 # Calcula o tempo decorrido até agora
                 elapsed_time = int(time.time() - start_time)
                 
                 # Considera tanto 200 quanto 201 como sucesso
+                message_id = None
                 if response.status_code in [200, 201]:
                     result = response.json() if response.text else {}
+                    # Id usado para casar os recibos de entrega do webhook
+                    message_id = (result.get('key') or {}).get('id')
                     status = 'success'
                     error = None
                     success_count += 1
@@ -580,86 +716,101 @@ def send_messages_task(numbers, message, instance, delay_range):
                     error = f"Erro {response.status_code}: {response.text}"
                     error_count += 1
                 
+                # Um evento por envio (amostrado); falhas são sempre registradas
+                log_event('send_result', logging.INFO if status == 'success' else logging.WARNING,
+                          job_id=job.job_id, instance=instance, number=number,
+                          status_code=response.status_code, message_id=message_id, error=error)
+                
                 # Salva no histórico com o tempo total até o momento
-                c.execute('''INSERT INTO message_history 
-                            (instance_name, number, message, status, error, delay, total_time)
-                            VALUES (?, ?, ?, ?, ?, ?, ?)''',
-                         (instance, number, message, status, error, delay, elapsed_time))
-                conn.commit()
+                history_writer.submit(instance, number, message, status,
+                                      error, delay, elapsed_time, message_id)
                 
-                # Emite o resultado
-                socketio.emit('send_result', {
+                # Registra o resultado (publicado em frames agrupados)
+                current += 1
+                job.add_result({
                     'number': number,
                     'status': status,
                     'error': error,
                     'delay': delay,
                     'total_time': elapsed_time
                 })
-
-                # Incrementa o contador e emite o progresso após o envio
-                current += 1
-                socketio.emit('send_progress', {
-                    'current': current,
-                    'total': total,
-                    'number': number,
-                    'elapsed_time': elapsed_time
-                })
                 
-                # Aguarda o delay para o próximo envio
-                time.sleep(delay)
+                # Aguarda o delay para o próximo envio (interrompido se cancelado)
+                job.sleep(delay)
                 
             except Exception as e:
                 error_msg = str(e)
-                print(f"Erro ao enviar mensagem para {number}: {error_msg}")  # Debug
+                log_event('send_error', logging.ERROR, exc_info=True,
+                          job_id=job.job_id, instance=instance, number=number)
                 
                 # Calcula o tempo decorrido mesmo em caso de erro
                 elapsed_time = int(time.time() - start_time)
                 error_count += 1
                 
                 # Salva o erro no histórico com o tempo total
-                c.execute('''INSERT INTO message_history 
-                            (instance_name, number, message, status, error, delay, total_time)
-                            VALUES (?, ?, ?, ?, ?, ?, ?)''',
-                         (instance, number, message, 'error', error_msg, delay, elapsed_time))
-                conn.commit()
+                history_writer.submit(instance, number, message, 'error',
+                                      error_msg, delay, elapsed_time)
                 
                 # Emite o erro
-                socketio.emit('send_error', {
+                job.emit('send_error', {
                     'number': number,
                     'error': error_msg,
                     'total_time': elapsed_time
                 })
 
-                # Incrementa o contador e emite o progresso mesmo em caso de erro
+                # Registra o resultado mesmo em caso de erro
                 current += 1
-                socketio.emit('send_progress', {
-                    'current': current,
-                    'total': total,
+                job.add_result({
                     'number': number,
-                    'elapsed_time': elapsed_time
+                    'status': 'error',
+                    'error': error_msg,
+                    'delay': delay,
+                    'total_time': elapsed_time
                 })
                 
                 # Aguarda o delay mesmo em caso de erro
-                time.sleep(delay)
+                job.sleep(delay)
+        failure = None
+    except Exception as e:
+        failure = str(e)
+        log_event('send_task_error', logging.ERROR, exc_info=True,
+                  job_id=job.job_id, instance=instance)
+    finally:
+        # Garante que todo o histórico do envio foi gravado antes de concluir;
+        # linhas que o banco recusou ficam para nova tentativa e vão no resumo
+        history_pending = history_writer.flush()
+        if history_pending:
+            log_event('send_history_pending', logging.WARNING,
+                      job_id=job.job_id, rows=history_pending)
         
         # Calcula o tempo total gasto
         total_time = int(time.time() - start_time)
         
-        # Calcula a média de tempo por mensagem (em segundos)
-        avg_time = total_time / total if total > 0 else 0
+        # Calcula a média de tempo por mensagem (em segundos); num envio
+        # cancelado, considera apenas os números processados
+        avg_time = total_time / current if current > 0 else 0
         
         # Emite conclusão com estatísticas detalhadas
-        socketio.emit('send_complete', {
+        summary = {
             'total_sent': current,
             'success_count': success_count,
             'error_count': error_count,
+            'suppressed_count': suppressed_count,
             'total_time': total_time,
             'avg_time': round(avg_time, 1),
-            'success_rate': round((success_count / total) * 100 if total > 0 else 0, 1)
-        })
-        
-    finally:
-        conn.close()
+            'success_rate': round((success_count / current) * 100 if current > 0 else 0, 1)
+        }
+        if history_pending:
+            summary['history_pending'] = history_pending
+        job.complete(summary, error=failure)
+
+# Mede o tempo de resposta de todas as rotas registradas acima
+metrics.instrument_app(app)
 
 if __name__ == '__main__':
-    socketio.run(app, debug=True)
\ No newline at end of file
+    # Debug desligado por padrão; endereço e concorrência configuráveis via .env
+    socketio.run(app,
+                 host=os.getenv('HOST', '127.0.0.1'),
+                 port=int(os.getenv('PORT', '5000')),
+                 debug=os.getenv('FLASK_DEBUG') == '1',
+                 **cooperative.server_options())
\ No newline at end of file
@@ -0,0 +1,24 @@
+import argparse
+
+from dotenv import load_dotenv
+
+import database
+
+
+def main(argv=None):
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description='Agregados do histórico de envios')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('backfill', help='Recalcula os agregados a partir do histórico')
+    args = parser.parse_args(argv)
+
+    database.init_db()
+
+    if args.command == 'backfill':
+        total = database.rebuild_history_stats()
+        print(f'Agregados recalculados a partir de {total} registros do histórico')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+import csv
+import io
+import threading
+
+import database
+
+# Linhas gravadas por transação na importação de CSV
+IMPORT_BATCH_SIZE = 10000
+
+
+def normalize_number(number):
+    # Remove qualquer caractere que não seja dígito
+    cleaned = ''.join(filter(str.isdigit, str(number)))
+    # Adiciona o código do país se não estiver presente
+    if cleaned and len(cleaned) <= 13 and not cleaned.startswith('55'):
+        cleaned = '55' + cleaned
+    return cleaned
+
+
+class SuppressionList:
+    """Números que pediram para não ser contatados.
+
+    A lista fica no banco (suppression_list) e é espelhada em memória como
+    um conjunto de inteiros: a consulta no envio é O(1) e, mesmo com
+    milhões de números, ocupa bem menos memória que um conjunto de strings.
+    Toda alteração passa pelo banco e em seguida pelo conjunto.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._numbers = set()
+        self._loaded = False
+
+    def load(self):
+        numbers = {int(number) for number in database.iter_suppressed_numbers() if number.isdigit()}
+        with self._lock:
+            self._numbers = numbers
+            self._loaded = True
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.load()
+
+    def __len__(self):
+        self._ensure_loaded()
+        return len(self._numbers)
+
+    def contains(self, number):
+        self._ensure_loaded()
+        cleaned = normalize_number(number)
+        return bool(cleaned) and int(cleaned) in self._numbers
+
+    def add(self, numbers, reason=None):
+        self._ensure_loaded()
+        cleaned = [number for number in dict.fromkeys(map(normalize_number, numbers)) if number]
+        added = database.add_suppressed_numbers(cleaned, reason)
+        with self._lock:
+            self._numbers.update(map(int, cleaned))
+        return added
+
+    def remove(self, numbers):
+        self._ensure_loaded()
+        cleaned = [number for number in dict.fromkeys(map(normalize_number, numbers)) if number]
+        removed = database.remove_suppressed_numbers(cleaned)
+        with self._lock:
+            self._numbers.difference_update(map(int, cleaned))
+        return removed
+
+    def import_csv(self, stream, reason=None, batch_size=IMPORT_BATCH_SIZE):
+        # Lê o CSV em streaming (número na primeira coluna) e grava em lotes
+        if isinstance(stream, io.TextIOBase):
+            text = stream
+        else:
+            text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+
+        read = 0
+        added = 0
+        batch = []
+        for row in csv.reader(text):
+            if not row:
+                continue
+            number = normalize_number(row[0])
+            if not number:
+                continue  # cabeçalho ou linha inválida
+            read += 1
+            batch.append(number)
+            if len(batch) >= batch_size:
+                added += self.add(batch, reason)
+                batch = []
+        if batch:
+            added += self.add(batch, reason)
+        return {'read': read, 'added': added}
+
+
+suppression_list = SuppressionList()
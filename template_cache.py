@@ -0,0 +1,90 @@
+import hashlib
+import json
+import threading
+
+import database
+
+
+class TemplateCache:
+    """Cache em memória dos templates de mensagem.
+
+    É carregado uma vez a partir do banco e atualizado em write-through:
+    toda alteração passa pelo banco e, em seguida, pelo cache. O ETag
+    muda a cada alteração para que os clientes possam revalidar com
+    If-None-Match.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._templates = None
+        self._etag = None
+
+    def load(self):
+        templates = database.list_templates()
+        with self._lock:
+            self._templates = {template['id']: template for template in templates}
+            self._refresh_etag()
+
+    def _ensure_loaded(self):
+        if self._templates is None:
+            self.load()
+
+    def _refresh_etag(self):
+        payload = json.dumps(sorted(self._templates.items()), ensure_ascii=False)
+        self._etag = hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    def snapshot(self, newest_first=False):
+        # Lista e ETag lidos juntos, para que correspondam à mesma versão
+        self._ensure_loaded()
+        with self._lock:
+            templates = sorted(self._templates.values(), key=lambda t: t['id'],
+                               reverse=newest_first)
+            etag = self._etag
+        return [dict(template) for template in templates], etag
+
+    @staticmethod
+    def _template_id(template_id):
+        try:
+            return int(template_id)
+        except (TypeError, ValueError):
+            raise ValueError('ID do template inválido')
+
+    def get(self, template_id):
+        self._ensure_loaded()
+        try:
+            template_id = int(template_id)
+        except (TypeError, ValueError):
+            return None
+        template = self._templates.get(template_id)
+        return dict(template) if template else None
+
+    def create(self, name, content):
+        self._ensure_loaded()
+        template_id = database.create_template(name, content)
+        with self._lock:
+            self._templates[template_id] = {'id': template_id, 'name': name, 'content': content}
+            self._refresh_etag()
+        return template_id
+
+    def update(self, template_id, name, content):
+        self._ensure_loaded()
+        template_id = self._template_id(template_id)
+        updated = database.update_template(template_id, name, content)
+        if updated:
+            with self._lock:
+                self._templates[template_id] = {'id': template_id, 'name': name, 'content': content}
+                self._refresh_etag()
+        return updated
+
+    def delete(self, template_id):
+        self._ensure_loaded()
+        template_id = self._template_id(template_id)
+        deleted = database.delete_template(template_id)
+        if deleted:
+            with self._lock:
+                self._templates.pop(template_id, None)
+                self._refresh_etag()
+        return deleted
+
+
+template_cache = TemplateCache()
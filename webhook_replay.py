@@ -0,0 +1,95 @@
+import argparse
+import json
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from dotenv import load_dotenv
+
+import database
+
+
+def load_events(path):
+    # Um payload de webhook gravado por linha (NDJSON)
+    with open(path, encoding='utf-8') as events:
+        for line in events:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def synthesize_events(limit):
+    # Gera recibos 'entregue' e 'lido' para os envios mais recentes do histórico
+    with database.connection() as conn:
+        rows = conn.execute('''SELECT instance_name, number, message_id FROM message_history
+                               WHERE message_id IS NOT NULL
+                               ORDER BY id DESC LIMIT ?''', (limit,)).fetchall()
+    for status in ('DELIVERY_ACK', 'READ'):
+        for row in rows:
+            yield {
+                'event': 'messages.update',
+                'instance': row['instance_name'],
+                'data': {
+                    'keyId': row['message_id'],
+                    'remoteJid': f"{row['number']}@s.whatsapp.net",
+                    'fromMe': True,
+                    'status': status
+                }
+            }
+
+
+def main(argv=None):
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description='Reenvia eventos de webhook gravados para o app')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--file', help='Arquivo NDJSON com os payloads gravados')
+    source.add_argument('--from-db', type=int, metavar='N',
+                        help='Gera eventos para os N envios mais recentes do histórico')
+    parser.add_argument('--url', default='http://localhost:5000/webhook/evolution')
+    parser.add_argument('--token', help='Token do webhook (WEBHOOK_TOKEN)')
+    parser.add_argument('--concurrency', type=int, default=8, help='Requisições simultâneas')
+    parser.add_argument('--rate', type=float, default=0,
+                        help='Eventos por segundo (0 = rajada, sem espera)')
+    args = parser.parse_args(argv)
+
+    if args.file:
+        events = list(load_events(args.file))
+    else:
+        database.init_db()
+        events = list(synthesize_events(args.from_db))
+
+    session = requests.Session()
+    headers = {'X-Webhook-Token': args.token} if args.token else {}
+
+    def post(event):
+        try:
+            return session.post(args.url, json=event, headers=headers, timeout=10).status_code
+        except requests.RequestException:
+            return 'erro'
+
+    started = time.perf_counter()
+    statuses = Counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = []
+        for index, event in enumerate(events):
+            if args.rate:
+                delay = started + index / args.rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            futures.append(executor.submit(post, event))
+        for future in futures:
+            statuses[future.result()] += 1
+    elapsed = time.perf_counter() - started
+
+    print(json.dumps({
+        'events': len(events),
+        'elapsed_s': round(elapsed, 3),
+        'events_per_s': round(len(events) / elapsed, 1) if elapsed else None,
+        'status_codes': {str(code): count for code, count in statuses.items()}
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+import os
+import time
+
+import database
+from batch_writer import BatchWriter
+from recent_history import recent_history
+
+# Token opcional exigido no webhook (?token=... ou cabeçalho X-Webhook-Token)
+WEBHOOK_TOKEN = os.getenv('WEBHOOK_TOKEN')
+
+# Limite da fila: acima disso o webhook responde 503 e a Evolution API reenvia
+QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '100000'))
+
+BATCH_SIZE = int(os.getenv('RECEIPT_BATCH_SIZE', '500'))
+FLUSH_INTERVAL = float(os.getenv('RECEIPT_FLUSH_INTERVAL', '0.5'))
+
+# Eventos da Evolution API que carregam atualizações de status de mensagem
+STATUS_EVENTS = ('messages.update', 'messages_update', 'MESSAGES_UPDATE', 'send.message')
+
+# Status da Evolution API (texto ou código numérico do WhatsApp) -> status interno
+STATUS_MAP = {
+    'ERROR': 'failed',
+    'PENDING': 'pending',
+    'SERVER_ACK': 'sent',
+    'DELIVERY_ACK': 'delivered',
+    'READ': 'read',
+    'PLAYED': 'read',
+    0: 'failed',
+    1: 'pending',
+    2: 'sent',
+    3: 'delivered',
+    4: 'read',
+    5: 'read',
+}
+
+
+def normalize_status(status):
+    if isinstance(status, str):
+        status = int(status) if status.isdigit() else status.upper()
+    return STATUS_MAP.get(status)
+
+
+def _message_id(item):
+    key = item.get('key') or {}
+    return item.get('keyId') or key.get('id') or item.get('messageId') or item.get('id')
+
+
+def _status(item):
+    update = item.get('update') or {}
+    return item.get('status', update.get('status'))
+
+
+def parse_receipts(payload):
+    """Extrai os recibos de entrega de um payload de webhook.
+
+    Aceita um evento ou uma lista de eventos, e o campo data como objeto
+    ou lista. Eventos sem id de mensagem ou com status desconhecido são
+    ignorados.
+    """
+    events = payload if isinstance(payload, list) else [payload]
+    now = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+    receipts = []
+    for event in events:
+        if not isinstance(event, dict) or event.get('event') not in STATUS_EVENTS:
+            continue
+        data = event.get('data')
+        items = data if isinstance(data, list) else [data]
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            message_id = _message_id(item)
+            status = normalize_status(_status(item))
+            if message_id and status:
+                receipts.append({
+                    'message_id': message_id,
+                    'instance_name': event.get('instance'),
+                    'status': status,
+                    'updated_at': now,
+                })
+    return receipts
+
+
+class ReceiptWriter(BatchWriter):
+    """Aplica os recibos de entrega ao histórico em lotes.
+
+    O webhook apenas enfileira os recibos e responde; a gravação (upsert em
+    delivery_receipts e atualização das linhas de message_history pelo id
+    da mensagem) acontece nesta thread, fora dos workers do Flask.
+    """
+
+    name = 'receipt-writer'
+
+    def __init__(self, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL, maxsize=QUEUE_SIZE):
+        super().__init__(batch_size, flush_interval, maxsize)
+
+    def write_batch(self, batch):
+        database.save_delivery_receipts(batch)
+        recent_history.apply_receipts(batch)
+
+
+receipt_writer = ReceiptWriter()